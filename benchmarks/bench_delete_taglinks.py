@@ -0,0 +1,65 @@
+"""
+Benchmark deleting a tag's taglinks row by row through the ORM against a single filtered bulk DELETE.
+
+Needs a database configured in config.yaml. Creates (and finally deletes) a throwaway account:
+
+    SIZES=1000,100000 python -m benchmarks.bench_delete_taglinks
+"""
+from uuid import uuid4
+
+import os
+import time
+
+from sqlalchemy import insert
+
+from manager import manager, models
+from manager.database import SessionLocal
+
+SIZES = [int(size) for size in os.environ.get('SIZES', '1000,100000').split(',')]
+BATCH_SIZE = 10000
+
+
+def create_taglinks(db, account_id: str, size: int) -> str:
+    tag_id = str(uuid4())
+    db.execute(insert(models.Tag), [{'tag_id': tag_id, 'account_id': account_id, 'tag': f'bench-{tag_id}'}])
+    for start in range(0, size, BATCH_SIZE):
+        link_ids = [str(uuid4()) for _ in range(min(BATCH_SIZE, size - start))]
+        db.execute(insert(models.Link), [{'link_id': link_id, 'account_id': account_id, 'link': 'https://bench.com'}
+                                         for link_id in link_ids])
+        db.execute(insert(models.TagLink), [{'tag_id': tag_id, 'link_id': link_id, 'account_id': account_id}
+                                            for link_id in link_ids])
+    # As if the taglinks had been created through the API, so deleting them leaves a link_count of 0
+    db.execute(insert(models.TagCount), [{'tag_id': tag_id, 'account_id': account_id, 'link_count': size}])
+    db.commit()
+    return tag_id
+
+
+def delete_row_by_row(db, tag_id: str):
+    # The previous implementation of manager.delete_taglinks. get_taglinks now returns plain column rows, so the ORM
+    # instances are loaded here.
+    for db_taglink in db.query(models.TagLink).filter(models.TagLink.tag_id == tag_id):
+        db.delete(db_taglink)
+    db.commit()
+
+
+def delete_bulk(db, tag_id: str):
+    manager.delete_taglinks(db, tag_id=tag_id)
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    account_id = str(uuid4())
+    db.execute(insert(models.Account), [{'account_id': account_id, 'email': f'bench-{account_id}@test.com',
+                                         'hashed_password': '', 'created': '2000-01-01 00:00:00'}])
+    db.commit()
+    try:
+        for size in SIZES:
+            for name, delete in (('row by row', delete_row_by_row), ('bulk', delete_bulk)):
+                tag_id = create_taglinks(db, account_id, size)
+                start = time.perf_counter()
+                delete(db, tag_id)
+                elapsed = time.perf_counter() - start
+                print(f"{size} taglinks, {name}: {elapsed * 1000:.1f} ms")
+    finally:
+        manager.delete_account(db, account_id)
+        db.close()
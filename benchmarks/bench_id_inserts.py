@@ -0,0 +1,47 @@
+"""
+Benchmark link insert throughput with random (uuid4) against time-ordered (uuid7) primary keys.
+
+Needs a database configured in config.yaml. Creates (and finally deletes) a throwaway account. Run it with enough
+ROWS that the link table's primary key index no longer fits in the buffer pool to see the page split cost:
+
+    ROWS=1000000 python -m benchmarks.bench_id_inserts
+"""
+from uuid import uuid4
+
+import os
+import time
+
+from sqlalchemy import insert
+
+from manager import manager, models, ids
+from manager.database import SessionLocal
+
+ROWS = int(os.environ.get('ROWS', 200000))
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 1000))
+
+
+def insert_links(db, account_id: str, generate) -> float:
+    start = time.perf_counter()
+    for batch_start in range(0, ROWS, BATCH_SIZE):
+        rows = [{'link_id': str(generate()), 'account_id': account_id, 'link': 'https://bench.com'}
+                for _ in range(min(BATCH_SIZE, ROWS - batch_start))]
+        db.execute(insert(models.Link), rows)
+        db.commit()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        for name, generate in ids.GENERATORS.items():
+            account_id = str(uuid4())
+            db.execute(insert(models.Account), [{'account_id': account_id, 'email': f'bench-{account_id}@test.com',
+                                                 'hashed_password': '', 'created': '2000-01-01 00:00:00'}])
+            db.commit()
+            try:
+                elapsed = insert_links(db, account_id, generate)
+                print(f"{name}: {ROWS} links in {elapsed:.1f} s, {ROWS / elapsed:.0f} rows/s")
+            finally:
+                manager.delete_account(db, account_id)
+    finally:
+        db.close()
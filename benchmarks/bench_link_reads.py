@@ -0,0 +1,61 @@
+"""
+Load benchmark for concurrent GET /link/ reads.
+
+Run against a deployed API (configured in integration_tests/test.yaml) before and after a change and compare the
+reported latency percentiles:
+
+    TEST_ENV=local CONCURRENCY=50 REQUESTS=2000 python -m benchmarks.bench_link_reads
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import logging
+import os
+import time
+
+from integration_tests.api_client import APIClient
+from integration_tests.test_base import BASE_URL, CA_CERT, USERNAME, PASSWORD
+
+CONCURRENCY = int(os.environ.get('CONCURRENCY', 50))
+REQUESTS = int(os.environ.get('REQUESTS', 2000))
+PATH = os.environ.get('BENCH_PATH', 'link')
+
+
+def get_token() -> str:
+    api_client = APIClient(base_url=BASE_URL, ca_cert=CA_CERT)
+    data = {'username': USERNAME, 'password': PASSWORD, 'scope': 'admin', 'grant_type': '', 'client_id': '',
+            'client_secret': ''}
+    resp = api_client.make_request('post', 'token', data=data)
+    resp.raise_for_status()
+    return resp.json()['access_token']
+
+
+def worker(token: str, count: int) -> List[float]:
+    api_client = APIClient(base_url=BASE_URL, ca_cert=CA_CERT)
+    api_client.set_headers({'Authorization': f'Bearer {token}'})
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        resp = api_client.make_request('get', PATH)
+        timings.append(time.perf_counter() - start)
+        resp.raise_for_status()
+    return timings
+
+
+def percentile(timings: List[float], pct: float) -> float:
+    index = min(len(timings) - 1, int(round(pct / 100 * len(timings))))
+    return sorted(timings)[index]
+
+
+if __name__ == "__main__":
+    logging.getLogger('integration_tests').setLevel(logging.WARNING)
+    token = get_token()
+    per_worker = max(1, REQUESTS // CONCURRENCY)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        results = list(executor.map(lambda _: worker(token, per_worker), range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    timings = [timing for result in results for timing in result]
+    print(f"GET /{PATH}: {len(timings)} requests, concurrency {CONCURRENCY}, {len(timings) / elapsed:.1f} req/s")
+    for pct in (50, 95, 99):
+        print(f"  p{pct}: {percentile(timings, pct) * 1000:.1f} ms")
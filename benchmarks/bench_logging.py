@@ -0,0 +1,48 @@
+"""
+Benchmark the per-request cost of logging in the request thread: the old print() calls (three per request) against
+structured logging through the queue, with the hot-path debug line sampled, enabled at DEBUG and disabled at INFO.
+
+Output goes to /dev/null, so this measures the caller's cost rather than the terminal's. No API or database needed:
+
+    REQUESTS=200000 python -m benchmarks.bench_logging
+"""
+import logging
+import os
+import time
+
+from manager import log
+
+REQUESTS = int(os.environ.get('REQUESTS', 200000))
+LOG = logging.getLogger('benchmarks.bench_logging')
+
+
+def print_request(stream):
+    print("authenticated as bench@test.com", file=stream)
+    print(['admin', 'account'], file=stream)
+    print(['account'], file=stream)
+
+
+def log_request(stream):
+    log.debug_sampled(LOG, "authenticated", entity="bench@test.com", entity_type="account")
+
+
+def run(request) -> float:
+    with open(os.devnull, 'w') as stream:
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            request(stream)
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    results = []
+    with open(os.devnull, 'w') as stream:
+        results.append(('print()', run(print_request)))
+        log.request_id.set('bench')
+        for level in ('DEBUG', 'INFO'):
+            log.configure_logging(level=level, stream=stream)
+            results.append((f'structured logging, level {level}, debug sample rate {log.DEBUG_SAMPLE_RATE}',
+                            run(log_request)))
+        log.stop_logging()
+    for name, elapsed in results:
+        print(f"{name}: {REQUESTS / elapsed:,.0f} requests/s, {elapsed / REQUESTS * 1e6:.2f} us per request")
@@ -0,0 +1,41 @@
+"""
+Benchmark the per-request cost of pool_pre_ping against pinging only idle connections.
+
+Needs a database configured in config.yaml. Each simulated request opens a session and runs QUERIES queries, as the
+API does, with one connection checkout:
+
+    REQUESTS=2000 QUERIES=3 python -m benchmarks.bench_pool_ping
+"""
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import os
+import time
+
+from manager.database import create_database_engine, SQLALCHEMY_DATABASE_URL
+
+REQUESTS = int(os.environ.get('REQUESTS', 2000))
+QUERIES = int(os.environ.get('QUERIES', 3))
+
+
+def run_requests(session_factory) -> float:
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        db = session_factory()
+        try:
+            for _ in range(QUERIES):
+                db.execute(text("SELECT account_id FROM account LIMIT 1")).all()
+        finally:
+            db.close()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    for name, pre_ping in (('pool_pre_ping', True), ('idle ping', False)):
+        engine = create_database_engine(SQLALCHEMY_DATABASE_URL, pre_ping=pre_ping)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Warm the pool so connection setup is not measured
+        run_requests(session_factory)
+        elapsed = run_requests(session_factory)
+        print(f"{name}: {elapsed / REQUESTS * 1000:.3f} ms per request")
+        engine.dispose()
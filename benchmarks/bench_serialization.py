@@ -0,0 +1,71 @@
+"""
+Benchmark loading and serializing a 10k link list: ORM instances through FastAPI's jsonable_encoder (the old path)
+against rows of columns through manager.serialization.
+
+Needs a database configured in config.yaml. Creates (and finally deletes) a throwaway account:
+
+    LINKS=10000 RUNS=20 python -m benchmarks.bench_serialization
+"""
+from uuid import uuid4
+
+import json
+import os
+import time
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import insert
+
+from manager import manager, models, ids
+from manager.database import SessionLocal
+from manager.serialization import serialize
+
+LINKS = int(os.environ.get('LINKS', 10000))
+RUNS = int(os.environ.get('RUNS', 20))
+
+
+def orm_path(db, account_id: str):
+    links = db.query(models.Link).filter(models.Link.account_id == account_id).all()
+    load = time.perf_counter()
+    json.dumps(jsonable_encoder(links)).encode()
+    return links, load
+
+
+def row_path(db, account_id: str):
+    links = manager.get_links(db, account_id=account_id)
+    load = time.perf_counter()
+    serialize(links)
+    return links, load
+
+
+def run(db, account_id: str, path):
+    load_total = 0.0
+    serialize_total = 0.0
+    for _ in range(RUNS):
+        # Expunge ORM instances from earlier runs, so every run loads from the database
+        db.expunge_all()
+        start = time.perf_counter()
+        links, load = path(db, account_id)
+        end = time.perf_counter()
+        assert len(links) == LINKS
+        load_total += load - start
+        serialize_total += end - load
+    return load_total / RUNS * 1000, serialize_total / RUNS * 1000
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    account_id = str(uuid4())
+    try:
+        db.execute(insert(models.Account), [{'account_id': account_id, 'email': f'bench-{account_id}@test.com',
+                                             'hashed_password': '', 'created': '2000-01-01 00:00:00'}])
+        db.execute(insert(models.Link), [{'link_id': ids.new_id(), 'account_id': account_id,
+                                          'link': f'https://bench{i}.com/some/path?query={i}'} for i in range(LINKS)])
+        db.commit()
+
+        for name, path in (('ORM + jsonable_encoder', orm_path), ('rows + orjson', row_path)):
+            load_ms, serialize_ms = run(db, account_id, path)
+            print(f"{name}: load {load_ms:.1f} ms, serialize {serialize_ms:.1f} ms, "
+                  f"total {load_ms + serialize_ms:.1f} ms")
+    finally:
+        manager.delete_account(db, account_id)
+        db.close()
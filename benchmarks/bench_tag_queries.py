@@ -0,0 +1,66 @@
+"""
+Benchmark multi-tag (AND / OR / NOT) link queries on a large account.
+
+Needs a database configured in config.yaml. Seeds a throwaway account with LINKS links, each tagged with
+TAGS_PER_LINK tags drawn from a vocabulary of VOCABULARY tags (1M taglinks by default), then deletes it:
+
+    LINKS=250000 TAGS_PER_LINK=4 python -m benchmarks.bench_tag_queries
+"""
+from uuid import uuid4
+
+import os
+import random
+import time
+
+from sqlalchemy import insert
+
+from manager import manager, models
+from manager.database import SessionLocal
+
+LINKS = int(os.environ.get('LINKS', 250000))
+TAGS_PER_LINK = int(os.environ.get('TAGS_PER_LINK', 4))
+VOCABULARY = int(os.environ.get('VOCABULARY', 200))
+REPEAT = int(os.environ.get('REPEAT', 5))
+BATCH_SIZE = 10000
+
+QUERIES = {
+    'tag': {'tag': 'tag0'},
+    'AND': {'all_tags': ['tag0', 'tag1']},
+    'OR': {'any_tags': ['tag0', 'tag1']},
+    'AND NOT': {'all_tags': ['tag0', 'tag1'], 'not_tags': ['tag2']},
+    'NOT': {'not_tags': ['tag0']},
+}
+
+
+def seed(db, account_id: str):
+    tag_ids = [str(uuid4()) for _ in range(VOCABULARY)]
+    db.execute(insert(models.Tag), [{'tag_id': tag_id, 'account_id': account_id, 'tag': f'tag{i}'}
+                                    for i, tag_id in enumerate(tag_ids)])
+    for start in range(0, LINKS, BATCH_SIZE):
+        link_ids = [str(uuid4()) for _ in range(min(BATCH_SIZE, LINKS - start))]
+        db.execute(insert(models.Link), [{'link_id': link_id, 'account_id': account_id, 'link': 'https://bench.com'}
+                                         for link_id in link_ids])
+        db.execute(insert(models.TagLink), [{'tag_id': tag_id, 'link_id': link_id, 'account_id': account_id}
+                                            for link_id in link_ids
+                                            for tag_id in random.sample(tag_ids, TAGS_PER_LINK)])
+        db.commit()
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    account_id = str(uuid4())
+    db.execute(insert(models.Account), [{'account_id': account_id, 'email': f'bench-{account_id}@test.com',
+                                         'hashed_password': '', 'created': '2000-01-01 00:00:00'}])
+    db.commit()
+    try:
+        seed(db, account_id)
+        print(f"{LINKS} links, {LINKS * TAGS_PER_LINK} taglinks")
+        for name, params in QUERIES.items():
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                links = manager.get_links(db, account_id=account_id, limit=manager.DEFAULT_PAGE_SIZE, **params)
+            elapsed = (time.perf_counter() - start) / REPEAT
+            print(f"  {name}: {elapsed * 1000:.1f} ms per page of {len(links)}")
+    finally:
+        manager.delete_account(db, account_id)
+        db.close()
@@ -0,0 +1,64 @@
+"""
+Benchmark creating links and tags through manager, returning the written objects as they are against reading each
+one back with refresh() after commit, as the write functions used to.
+
+Needs a database configured in config.yaml. Creates (and finally deletes) a throwaway account:
+
+    WRITES=2000 python -m benchmarks.bench_write_refresh
+"""
+from typing import Tuple
+from uuid import uuid4
+
+import os
+import time
+
+from sqlalchemy import insert
+
+from manager import manager, metrics, models, schemas
+from manager.database import SessionLocal
+
+WRITES = int(os.environ.get('WRITES', 2000))
+
+
+def create_link(db, account_id: str, index: int):
+    return manager.create_link(db, schemas.PostLink(link=f'https://bench{index}.com', tag='bench',
+                                                    account_id=account_id))
+
+
+def create_tag(db, account_id: str, index: int):
+    return manager.create_tag(db, schemas.PostTag(tag=f'bench{index}', account_id=account_id))
+
+
+def run(db, account_id: str, write, refresh: bool, offset: int) -> Tuple[float, float]:
+    # Returns the mean latency in ms and the number of SQL statements per write
+    stats = metrics.RequestStats()
+    token = metrics.current_request_stats.set(stats)
+    try:
+        start = time.perf_counter()
+        for index in range(offset, offset + WRITES):
+            written = write(db, account_id, index)
+            if refresh:
+                db.refresh(written)
+        elapsed = time.perf_counter() - start
+    finally:
+        metrics.current_request_stats.reset(token)
+    return elapsed / WRITES * 1000, stats.sql_statements / WRITES
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    account_id = str(uuid4())
+    try:
+        db.execute(insert(models.Account), [{'account_id': account_id, 'email': f'bench-{account_id}@test.com',
+                                             'hashed_password': '', 'created': '2000-01-01 00:00:00'}])
+        db.commit()
+        offset = 0
+        for name, write in (('create_link', create_link), ('create_tag', create_tag)):
+            for refresh in (True, False):
+                latency, statements = run(db, account_id, write, refresh, offset)
+                offset += WRITES
+                print(f"{name} {'with' if refresh else 'without'} refresh: {latency:.2f} ms, "
+                      f"{statements:.1f} SQL statements per write")
+    finally:
+        manager.delete_account(db, account_id)
+        db.close()
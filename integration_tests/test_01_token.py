@@ -80,3 +80,13 @@ class TokenTests(IntegrationTestsBase):
 
         # Delete Account with Account Token
         self.delete_account(account_id=account_id, token=account_token)
+
+    def test_106_get_metrics_requires_admin(self):
+        LOG.info("====TEST get_metrics_requires_admin====")
+        resp = self.api_client.make_request('get', 'metrics')
+        self.assertEqual(401, resp.status_code)
+
+        self.get_admin_token()
+        self.set_api_headers(content_type=ContentType.JSON, token=self.admin_token)
+        resp = self.api_client.make_request('get', 'metrics')
+        self.assertEqual(200, resp.status_code)
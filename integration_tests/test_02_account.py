@@ -1,4 +1,6 @@
+import json
 import logging
+import time
 
 from integration_tests.test_base import IntegrationTestsBase, ContentType
 
@@ -117,6 +119,61 @@ class AccountTests(IntegrationTestsBase):
         account_id = self.accounts[self.account_emails[1]]['account_id']
         self.delete_account(account_id=account_id, token=self.admin_token)
 
+    def test_211_export_account(self):
+        LOG.info("====TEST export_account====")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        self.create_link(link='https://export1.com', token=account_token, tag='export1')
+        self.create_link(link='https://export2.com', token=account_token, tag='export1')
+
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+        resp = self.api_client.make_request('get', f'account/{account_id}/export')
+        self.assertEqual(200, resp.status_code)
+        self.assertTrue(resp.headers['Content-Type'].startswith('application/x-ndjson'))
+        records = [json.loads(line) for line in resp.text.splitlines()]
+        self.assertEqual(len([record for record in records if record['type'] == 'link']), 2)
+        self.assertEqual(len([record for record in records if record['type'] == 'tag']), 1)
+        self.assertEqual(len([record for record in records if record['type'] == 'taglink']), 2)
+        for record in records:
+            self.assertEqual(record['account_id'], account_id)
+
+        # Account scope cannot export other accounts
+        account_id_2 = 'invalid'
+        resp = self.api_client.make_request('get', f'account/{account_id_2}/export')
+        self.assertEqual(404, resp.status_code)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_212_delete_account_background(self):
+        LOG.info("====TEST delete_account_background====")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        self.create_link(link='https://background1.com', token=self.admin_token, tag='background1',
+                         account_id=account_id)
+        self.create_link(link='https://background2.com', token=self.admin_token, tag='background1',
+                         account_id=account_id)
+
+        self.set_api_headers(content_type=ContentType.JSON, token=self.admin_token)
+        resp = self.api_client.make_request('delete', f'account/{account_id}', params={'background': 'true'})
+        self.assertEqual(202, resp.status_code)
+        job = resp.json()
+        # 2 links, 1 tag, 1 tag count, 2 taglinks and the account itself
+        self.assertEqual(job['total'], 7)
+
+        for _ in range(20):
+            resp = self.api_client.make_request('get', f"account/{account_id}/deletion/{job['job_id']}")
+            self.assertEqual(200, resp.status_code)
+            job = resp.json()
+            if job['status'] in ('complete', 'failed'):
+                break
+            time.sleep(0.5)
+        self.assertEqual(job['status'], 'complete')
+        self.assertEqual(job['deleted'], 7)
+
+        accounts = self.get_accounts(token=self.admin_token, email=self.account_emails[0])
+        self.assertEqual(len(accounts), 0)
+
 
 
 
@@ -1,4 +1,5 @@
 import logging
+import uuid
 
 from integration_tests.test_base import IntegrationTestsBase, ContentType
 
@@ -241,3 +242,270 @@ class LinkTests(IntegrationTestsBase):
         self.assertEqual(len(links), 0)
         links = self.get_links(token=self.admin_token, account_id=account_id_2)
         self.assertEqual(len(links), 0)
+
+    def test_327_get_links_paginated(self):
+        LOG.info("====TEST get_links_paginated===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        for i in range(5):
+            self.create_link(link=f'https://page{i}.com', token=account_token, tag='paged')
+
+        link_ids = []
+        params = {'limit': 2}
+        while True:
+            self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+            resp = self.api_client.make_request('get', 'link', params=params)
+            self.assertEqual(200, resp.status_code)
+            links = resp.json()
+            self.assertTrue(len(links) <= 2)
+            link_ids.extend(link['link_id'] for link in links)
+            next_cursor = resp.headers.get('X-Next-Cursor')
+            if next_cursor is None:
+                break
+            params['cursor'] = next_cursor
+        self.assertEqual(len(link_ids), 5)
+        self.assertEqual(len(set(link_ids)), 5)
+
+        resp = self.api_client.make_request('get', 'link', params={'cursor': 'invalid'})
+        self.assertEqual(422, resp.status_code)
+        resp_json = resp.json()
+        self.assertEqual(resp_json['detail'], 'Invalid cursor')
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_328_create_links_bulk(self):
+        LOG.info("====TEST create_links_bulk===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        tag = self.create_tag(tag='bulk1', token=account_token)
+
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+        json = [
+            {'link': 'https://bulk1.com', 'tag': 'bulk1'},
+            {'link': 'https://bulk2.com', 'tag': 'bulk2'},
+            {'link': 'https://bulk3.com', 'tag': 'bulk2'},
+            {'link': 'https://bulk4.com', 'tag_id': tag['tag_id']},
+            {'link': 'https://bulk5.com', 'tag_id': 'invalid'},
+            {'link': 'https://bulk6.com'},
+        ]
+        resp = self.api_client.make_request('post', 'link/bulk', json=json)
+        self.assertEqual(200, resp.status_code)
+        results = resp.json()
+        self.assertEqual([result['status_code'] for result in results], [200, 200, 200, 200, 404, 422])
+        self.assertEqual(results[0]['tag_id'], tag['tag_id'])
+        self.assertEqual(results[1]['tag_id'], results[2]['tag_id'])
+        self.assertEqual(results[3]['tag_id'], tag['tag_id'])
+        self.assertEqual(results[4]['detail'], f'Tag with tag_id invalid not found for account_id {account_id}')
+        self.assertEqual(results[5]['detail'], 'One of tag_id or tag must be specified')
+
+        links = self.get_links(token=account_token)
+        self.assertEqual(len(links), 4)
+        links = self.get_links(token=account_token, tag='bulk2')
+        self.assertEqual(len(links), 2)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_329_get_links_by_tag_expression(self):
+        LOG.info("====TEST get_links_by_tag_expression===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        link1 = self.create_link(link='https://python.com', token=account_token, tag='python')
+        link2 = self.create_link(link='https://fastapi.com', token=account_token, tag='python')
+        link3 = self.create_link(link='https://archived.com', token=account_token, tag='python')
+        fastapi = self.create_tag(tag='fastapi', token=account_token)
+        archived = self.create_tag(tag='archived', token=account_token)
+        self.create_taglink(tag_id=fastapi['tag_id'], link_id=link2['link_id'], token=account_token)
+        self.create_taglink(tag_id=fastapi['tag_id'], link_id=link3['link_id'], token=account_token)
+        self.create_taglink(tag_id=archived['tag_id'], link_id=link3['link_id'], token=account_token)
+
+        def link_ids(params):
+            self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+            resp = self.api_client.make_request('get', 'link', params=params)
+            self.assertEqual(200, resp.status_code)
+            return sorted(link['link_id'] for link in resp.json())
+
+        self.assertEqual(link_ids({'all_tags': ['python', 'fastapi']}),
+                         sorted([link2['link_id'], link3['link_id']]))
+        self.assertEqual(link_ids({'all_tags': ['python', 'fastapi'], 'not_tags': ['archived']}),
+                         [link2['link_id']])
+        # Names the database collation treats as equal name the same tag
+        self.assertEqual(link_ids({'all_tags': ['python', 'Python', 'fastapi ']}),
+                         sorted([link2['link_id'], link3['link_id']]))
+        self.assertEqual(link_ids({'all_tags': ['python', 'missing']}), [])
+        self.assertEqual(link_ids({'any_tags': ['fastapi', 'archived']}),
+                         sorted([link2['link_id'], link3['link_id']]))
+        self.assertEqual(link_ids({'not_tags': ['fastapi']}), [link1['link_id']])
+        self.assertEqual(link_ids({'tag': 'python', 'not_tags': ['fastapi']}), [link1['link_id']])
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_330_get_links_etag(self):
+        LOG.info("====TEST get_links_etag===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        self.create_link(link='https://etag1.com', token=account_token, tag='etag')
+
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+        resp = self.api_client.make_request('get', 'link', params={'tag': 'etag'})
+        self.assertEqual(200, resp.status_code)
+        etag = resp.headers.get('ETag')
+        self.assertIsNotNone(etag)
+
+        self.api_client.set_headers({'If-None-Match': etag})
+        resp = self.api_client.make_request('get', 'link', params={'tag': 'etag'})
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(resp.headers.get('ETag'), etag)
+        self.api_client.set_headers({'If-None-Match': None})
+
+        # A write to the account invalidates the cached list
+        self.create_link(link='https://etag2.com', token=account_token, tag='etag')
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+        self.api_client.set_headers({'If-None-Match': etag})
+        resp = self.api_client.make_request('get', 'link', params={'tag': 'etag'})
+        self.api_client.set_headers({'If-None-Match': None})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(len(resp.json()), 2)
+        self.assertNotEqual(resp.headers.get('ETag'), etag)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_331_get_link_etag(self):
+        LOG.info("====TEST get_link_etag===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        link = self.create_link(link='https://etag1.com', token=account_token, tag='etag')
+
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+        resp = self.api_client.make_request('get', f'link/{link["link_id"]}')
+        self.assertEqual(200, resp.status_code)
+        etag = resp.headers.get('ETag')
+        self.assertIsNotNone(etag)
+
+        self.api_client.set_headers({'If-None-Match': etag})
+        resp = self.api_client.make_request('get', f'link/{link["link_id"]}')
+        self.assertEqual(304, resp.status_code)
+        # ETags are per resource: the link's does not match other URLs of the account
+        resp = self.api_client.make_request('get', 'tag')
+        self.assertEqual(200, resp.status_code)
+        resp = self.api_client.make_request('get', f'link/{link["link_id"]}x')
+        self.assertEqual(404, resp.status_code)
+        self.api_client.set_headers({'If-None-Match': None})
+
+        # Any write to the account changes its version, and so the ETag
+        self.create_tag(tag='etag2', token=account_token)
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+        self.api_client.set_headers({'If-None-Match': etag})
+        resp = self.api_client.make_request('get', f'link/{link["link_id"]}')
+        self.api_client.set_headers({'If-None-Match': None})
+        self.assertEqual(200, resp.status_code)
+        self.assertNotEqual(resp.headers.get('ETag'), etag)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_332_sync(self):
+        LOG.info("====TEST sync===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        link1 = self.create_link(link='https://sync1.com', token=account_token, tag='sync')
+        self.create_link(link='https://sync2.com', token=account_token, tag='sync')
+
+        def sync(since):
+            changes = []
+            params = {'since': since, 'limit': 2}
+            while True:
+                self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+                resp = self.api_client.make_request('get', 'sync', params=params)
+                self.assertEqual(200, resp.status_code)
+                changes.extend(resp.json())
+                if resp.headers.get('X-Next-Cursor') is None:
+                    return changes, int(resp.headers['X-Sync-Version'])
+                params['cursor'] = resp.headers['X-Next-Cursor']
+
+        # 2 links, 1 tag and 2 taglinks
+        changes, version = sync(0)
+        self.assertEqual(len(changes), 5)
+        self.assertEqual(sorted(change['kind'] for change in changes), ['link', 'link', 'tag', 'taglink', 'taglink'])
+
+        changes, version = sync(version)
+        self.assertEqual(changes, [])
+
+        self.delete_link(link_id=link1['link_id'], token=account_token)
+        changes, version = sync(version)
+        self.assertEqual([(change['kind'], change['deleted']) for change in changes],
+                         [('taglink', True), ('link', True)])
+        self.assertEqual(changes[1]['link_id'], link1['link_id'])
+
+        link3 = self.create_link(link='https://sync3.com', token=account_token, tag='sync')
+        changes, version = sync(version)
+        self.assertEqual([(change['kind'], change['deleted']) for change in changes],
+                         [('link', False), ('taglink', False)])
+        self.assertEqual(changes[0]['link_id'], link3['link_id'])
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_333_create_links_bulk_admin_unknown_account(self):
+        LOG.info("====TEST create_links_bulk_admin_unknown_account===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        unknown_account_id = str(uuid.uuid4())
+
+        # An unknown account fails only its own links
+        self.set_api_headers(content_type=ContentType.JSON, token=self.admin_token)
+        json = [
+            {'link': 'https://bulk1.com', 'tag': 'bulk1', 'account_id': account_id},
+            {'link': 'https://bulk2.com', 'tag': 'bulk1', 'account_id': unknown_account_id},
+        ]
+        resp = self.api_client.make_request('post', 'link/bulk', json=json)
+        self.assertEqual(200, resp.status_code)
+        results = resp.json()
+        self.assertEqual([result['status_code'] for result in results], [200, 404])
+        self.assertEqual(results[1]['detail'], f'Account id {unknown_account_id} not found')
+        self.assertEqual(len(self.get_links(token=self.admin_token, account_id=account_id)), 1)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_334_create_link_admin_uppercase_account_id(self):
+        LOG.info("====TEST create_link_admin_uppercase_account_id===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+
+        # Ids are accepted in any case, and returned in canonical lowercase form
+        link = self.create_link(link='https://upper.com', token=self.admin_token, tag='upper',
+                                account_id=account_id.upper())
+        self.assertEqual(link['account_id'], account_id)
+        resp = self.api_client.make_request('post', 'link/bulk', json=[
+            {'link': 'https://upper2.com', 'tag': 'upper', 'account_id': account_id.upper()}])
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([result['status_code'] for result in resp.json()], [200])
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_335_create_links_bulk_collation_equal_tags(self):
+        LOG.info("====TEST create_links_bulk_collation_equal_tags===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        tag = self.create_tag(tag='caf\u00e9', token=account_token)
+
+        # Names the database collation treats as equal (accents, trailing spaces) are the same tag
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+        json = [
+            {'link': 'https://bulk1.com', 'tag': 'cafe'},
+            {'link': 'https://bulk2.com', 'tag': 'python'},
+            {'link': 'https://bulk3.com', 'tag': 'python '},
+        ]
+        resp = self.api_client.make_request('post', 'link/bulk', json=json)
+        self.assertEqual(200, resp.status_code)
+        results = resp.json()
+        self.assertEqual([result['status_code'] for result in results], [200, 200, 200])
+        self.assertEqual(results[0]['tag_id'], tag['tag_id'])
+        self.assertEqual(results[1]['tag_id'], results[2]['tag_id'])
+        self.assertEqual(len(self.get_tags(token=account_token)), 2)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
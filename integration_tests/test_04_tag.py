@@ -208,3 +208,29 @@ class TagTests(IntegrationTestsBase):
         self.assertEqual(len(tags), 0)
         tags = self.get_tags(token=self.admin_token, account_id=account_id_2)
         self.assertEqual(len(tags), 0)
+
+    def test_424_get_tags_with_counts(self):
+        LOG.info("====TEST get_tags_with_counts===")
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        link1 = self.create_link(link='https://count1.com', token=account_token, tag='count1')
+        self.create_link(link='https://count2.com', token=account_token, tag='count1')
+        self.create_link(link='https://count3.com', token=account_token, tag='count2')
+        tag3 = self.create_tag(tag='count3', token=account_token)
+
+        def get_counts():
+            self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+            resp = self.api_client.make_request('get', 'tag', params={'with_counts': 'true'})
+            self.assertEqual(200, resp.status_code)
+            return {tag['tag']: tag['link_count'] for tag in resp.json()}
+
+        self.assertEqual(get_counts(), {'count1': 2, 'count2': 1, 'count3': 0})
+
+        self.create_taglink(tag_id=tag3['tag_id'], link_id=link1['link_id'], token=account_token)
+        self.assertEqual(get_counts(), {'count1': 2, 'count2': 1, 'count3': 1})
+
+        self.delete_link(link_id=link1['link_id'], token=account_token)
+        self.assertEqual(get_counts(), {'count1': 1, 'count2': 1, 'count3': 0})
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
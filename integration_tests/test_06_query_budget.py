@@ -0,0 +1,132 @@
+from typing import Tuple
+
+import logging
+
+from integration_tests.test_base import IntegrationTestsBase, ContentType
+
+LOG = logging.getLogger(__name__)
+
+
+# SQL statement budgets per endpoint. Needs the API to run with debug.sql_statement_headers enabled (and no read
+# replicas, whose health checks would be counted). Budgets are for a warm process: each test makes a request first,
+# so the auth entity is cached.
+class QueryBudgetTests(IntegrationTestsBase):
+    __test__ = True
+    links = {}
+    tags = {}
+
+    def setUp(self):
+        super().setUp()
+        self.get_admin_token()
+
+    def create_budget_account(self) -> Tuple[str, str]:
+        self.create_account(email=self.account_emails[0])
+        account_id = self.accounts[self.account_emails[0]]['account_id']
+        account_token = self.get_account_token(account_id=account_id)
+        self.get_tags(token=account_token)
+        return account_id, account_token
+
+    def test_601_get_budgets(self):
+        LOG.info("====TEST get_budgets===")
+        account_id, account_token = self.create_budget_account()
+        link = self.create_link(link='https://budget1.com', token=account_token, tag='budget')
+        self.create_link(link='https://budget2.com', token=account_token, tag='budget')
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+
+        # The account version, then one query for the page
+        resp = self.api_client.make_request('get', 'link', params={'tag': 'budget'})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 2)
+        etag = resp.headers['ETag']
+
+        resp = self.api_client.make_request('get', f'link/{link["link_id"]}')
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 2)
+
+        resp = self.api_client.make_request('get', 'tag', params={'with_counts': 'true'})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 2)
+
+        resp = self.api_client.make_request('get', 'taglink', params={'link_id': link['link_id']})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 2)
+
+        # The account version, then one query each for links, tags, taglinks and tombstones
+        resp = self.api_client.make_request('get', 'sync', params={'since': 0})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 5)
+
+        # A client with the current version is answered from the version alone
+        self.api_client.set_headers({'If-None-Match': etag})
+        resp = self.api_client.make_request('get', 'link', params={'tag': 'budget'})
+        self.api_client.set_headers({'If-None-Match': None})
+        self.assertEqual(304, resp.status_code)
+        self.assert_sql_budget(resp, 1)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_602_post_budgets(self):
+        LOG.info("====TEST post_budgets===")
+        account_id, account_token = self.create_budget_account()
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+
+        # New tag: bump the account version, look up the tag, insert the link, tag and taglink and update the tag
+        # count. The link is returned as written, not read back.
+        resp = self.api_client.make_request('post', 'link', json={'link': 'https://budget1.com', 'tag': 'budget'})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 7)
+        link = resp.json()
+
+        resp = self.api_client.make_request('post', 'link', json={'link': 'https://budget2.com', 'tag': 'budget'})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 6)
+
+        resp = self.api_client.make_request('post', 'tag', json={'tag': 'budget2'})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 4)
+        tag = resp.json()
+
+        # Bump the account version, check the tag and link in one query, insert the taglink and update the tag count
+        resp = self.api_client.make_request('post', 'taglink', json={'tag_id': tag['tag_id'],
+                                                                     'link_id': link['link_id']})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 5)
+
+        # A duplicate is found by its primary key, rather than by looking it up first
+        resp = self.api_client.make_request('post', 'taglink', json={'tag_id': tag['tag_id'],
+                                                                     'link_id': link['link_id']})
+        self.assertEqual(409, resp.status_code)
+        self.assert_sql_budget(resp, 4)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_603_post_bulk_budget(self):
+        LOG.info("====TEST post_bulk_budget===")
+        account_id, account_token = self.create_budget_account()
+        self.create_link(link='https://budget.com', token=account_token, tag='budget')
+        self.set_api_headers(content_type=ContentType.JSON, token=account_token)
+
+        # The same statements for 1 link or 20, whichever tags they name: no query per link
+        links = [{'link': f'https://budget{i}.com', 'tag': f'budget{i % 5}'} for i in range(20)]
+        resp = self.api_client.make_request('post', 'link/bulk', json=links)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([result['status_code'] for result in resp.json()], [200] * 20)
+        self.assert_sql_budget(resp, 7)
+
+        self.delete_account(account_id=account_id, token=self.admin_token)
+
+    def test_604_post_account_budget(self):
+        LOG.info("====TEST post_account_budget===")
+        self.get_accounts(token=self.admin_token)
+        self.set_api_headers(content_type=ContentType.JSON, token=self.admin_token)
+
+        # Check the email is free and insert the account, which is returned as written
+        resp = self.api_client.make_request('post', 'account', json={'email': self.account_emails[0],
+                                                                     'password': self.account_password})
+        self.assertEqual(200, resp.status_code)
+        self.assert_sql_budget(resp, 2)
+        account = resp.json()
+        self.assertIsNotNone(account['created'])
+        self.assertEqual(account['version'], 0)
+
+        self.delete_account(account_id=account['account_id'], token=self.admin_token)
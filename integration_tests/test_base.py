@@ -6,6 +6,8 @@ import os
 import yaml
 import logging
 
+from requests import Response
+
 from integration_tests.api_client import APIClient
 
 LOG = logging.getLogger(__name__)
@@ -68,6 +70,19 @@ class IntegrationTestsBase(TestCase):
 
         self.api_client.set_headers(headers)
 
+    def assert_sql_budget(self, resp: Response, max_statements: int, max_repeats: int = 1) -> None:
+        # The API must run with debug.sql_statement_headers enabled. max_repeats is the number of times any one SQL
+        # statement may run: more than once usually means a query per row (N+1) where one query would do.
+        request = f'{resp.request.method} {resp.request.path_url}'
+        self.assertIn('X-SQL-Statement-Count', resp.headers,
+                      f'{request}: no SQL statement count, is debug.sql_statement_headers enabled?')
+        statements = int(resp.headers['X-SQL-Statement-Count'])
+        self.assertLessEqual(statements, max_statements,
+                             f'{request} ran {statements} SQL statements, the budget is {max_statements}')
+        repeats = int(resp.headers['X-SQL-Max-Repeats'])
+        self.assertLessEqual(repeats, max_repeats,
+                             f'{request} ran one SQL statement {repeats} times, the budget is {max_repeats}')
+
     def get_admin_token(self) -> str:
         data = {
             'username': self.username,
@@ -126,7 +141,7 @@ class IntegrationTestsBase(TestCase):
 
         self.assertIsNotNone(account['account_id'])
         self.assertIsNotNone(account['email'])
-        self.assertIsNotNone(account['hashed_password'])
+        self.assertNotIn('hashed_password', account)
 
         self.accounts[email] = account
 
@@ -156,9 +171,9 @@ class IntegrationTestsBase(TestCase):
         self.assertEqual(resp_json, "OK")
 
     def delete_accounts(self) -> None:
-        accounts = self.get_accounts(token=self.admin_token)
-        for account in accounts:
-            if account['email'] in self.account_emails:
+        # Look the test accounts up by email: an unfiltered GET /account/ only returns the first page of accounts
+        for email in self.account_emails:
+            for account in self.get_accounts(token=self.admin_token, email=email):
                 self.delete_account(account['account_id'], token=self.admin_token)
 
     def create_link(self, link: str, token: str, tag: str = None, tag_id: str = None,
@@ -1,99 +1,286 @@
-from typing import Optional
+from typing import Optional, List, Callable, Union
 from datetime import timedelta, datetime
 
+import hashlib
+import time
+import uuid
+
+from anyio import to_thread
+
+from sqlalchemy import exc
 from sqlalchemy.orm import Session
 
-from fastapi import FastAPI, HTTPException, Depends, status, Security
+from fastapi import FastAPI, HTTPException, Depends, status, Security, Query, Request, Response, BackgroundTasks
+
 
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, SecurityScopes
 
 from fastapi.middleware.cors import CORSMiddleware
 
-from manager import manager, schemas, authentication, CONFIG
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse, PlainTextResponse
 
-from manager.database import get_db
+from manager import manager, schemas, authentication, metrics, log, CONFIG
+
+from manager.database import get_db, get_read_db, get_pool_stats, get_replica_stats, SessionLocal, ReadSessionLocal
+from manager.database import pool_size, max_overflow
 
 from manager.authentication import SCOPE_ACCOUNT
 
+from manager.serialization import serialize
+
 from manager.schemas import EntityType
 
 
-app = FastAPI()
+log.configure_logging()
+
+# Responses that are not already serialized (see manager.serialization) are encoded with orjson
+app = FastAPI(default_response_class=ORJSONResponse)
 
 origins = [origin for origin in CONFIG['origins']]
 
+# Browsers only let cross-origin clients read custom response headers that are exposed: the pagination cursor, sync
+# version, ETag and request id are all needed by clients
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Sync-Version", "ETag", "X-Request-ID"],
 )
 
+SERVER_CONFIG = CONFIG.get('server', {})
+MAX_BULK_LINKS = CONFIG.get('bulk', {}).get('max_links', 10000)
+# By default, no more handlers run at once than there are database connections to serve them
+THREAD_POOL_SIZE = SERVER_CONFIG.get('thread_pool_size') or pool_size + max_overflow
+DEBUG_CONFIG = CONFIG.get('debug', {})
+SQL_STATEMENT_HEADERS = DEBUG_CONFIG.get('sql_statement_headers', False)
+
+
+# Route handlers are plain (sync) functions, so FastAPI runs them, and the blocking SQLAlchemy calls they make, in
+# the worker thread pool rather than on the event loop. anyio's default of 40 threads is more than the database pool
+# has connections, so under load most of them would only wait for a connection (up to pool_timeout) while holding a
+# thread. Sized to the pool instead, excess requests queue for a thread on the event loop.
+@app.on_event("startup")
+async def configure_thread_pool():
+    to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+
+
+# Record the latency, SQL statement count and time of every request, labelled by route template (not raw path, which
+# would make a metric per id). With debug.sql_statement_headers set (test deployments only), the statement counts are
+# also returned in response headers, for the integration tests' query budgets. Statements run while a streaming
+# response body is sent are not included.
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    stats = metrics.RequestStats()
+    metrics.current_request_stats.set(stats)
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        if SQL_STATEMENT_HEADERS:
+            response.headers['X-SQL-Statement-Count'] = str(stats.sql_statements)
+            response.headers['X-SQL-Max-Repeats'] = str(stats.max_repeats())
+        return response
+    finally:
+        route = route_paths.get(request.scope.get('endpoint'), 'unmatched')
+        metrics.observe_request(request.method, route, status_code, time.perf_counter() - start, stats)
+
+
+# Tag each request with an id, taken from the X-Request-ID header if the proxy set one, which is attached to every
+# log line for the request and returned to the client. Added last, so it runs first.
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    current_request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    log.request_id.set(current_request_id)
+    response = await call_next(request)
+    response.headers['X-Request-ID'] = current_request_id
+    return response
+
+
+# No database connection became free within the pool timeout: tell the client to retry rather than hang
+@app.exception_handler(exc.TimeoutError)
+def database_pool_timeout(request, ex):
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content={"detail": "No database connection available, please retry"},
+                        headers={"Retry-After": "1"})
+
+
+# Page size for list endpoints. Always bounded, so list responses stay small however large the tables grow.
+PageLimit = Query(manager.DEFAULT_PAGE_SIZE, ge=1, le=manager.MAX_PAGE_SIZE,
+                  description="Maximum number of results to return")
+PageCursor = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page")
+
+
+def set_next_cursor(response: Response, rows: list, key: tuple, limit: int):
+    next_cursor = manager.get_next_cursor(rows, key, limit)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def version_etag(request: Request, account_id: str, version: int) -> str:
+    # A validator for one URL at one version of the account, so an ETag from one resource never matches another. The
+    # URL is hashed in, rather than the body, so that a 304 still needs no more than the version lookup.
+    resource = f'{account_id}.{version} {request.url.path}?{sorted(request.query_params.multi_items())}'
+    return f'"{version}-{hashlib.blake2b(resource.encode(), digest_size=16).hexdigest()}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return None
+
+
+def list_response(request: Request, db: Session, account_id: Optional[str], key: tuple, limit: int,
+                  load: Callable[[], list]):
+    # Serve a list endpoint for one account from its version: a client that already has this version gets a 304, and
+    # otherwise the response cache is tried before running load(). The version changes with every write to the
+    # account, so neither can be stale. Lists across accounts are neither cached nor versioned, and get an ETag of
+    # the body instead.
+    cache_key = None
+    entry = None
+    if account_id is not None:
+        version = manager.get_account_version(db, account_id)
+        if version is not None:
+            etag = version_etag(request, account_id, version)
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+            cache_key = (account_id, version, request.url.path, tuple(sorted(request.query_params.multi_items())))
+            entry = manager.response_cache.get(cache_key)
+    if entry is None:
+        rows = load()
+        body = serialize(rows)
+        if cache_key is None:
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        entry = {'body': body, 'etag': etag, 'next_cursor': manager.get_next_cursor(rows, key, limit)}
+        if cache_key is not None and len(body) <= manager.RESPONSE_CACHE_MAX_ENTRY_BYTES:
+            manager.response_cache.set(cache_key, entry, size=len(body))
+
+    headers = {'ETag': entry['etag']}
+    if entry['next_cursor'] is not None:
+        headers['X-Next-Cursor'] = entry['next_cursor']
+    if etag_matches(request.headers.get('if-none-match'), entry['etag']):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry['body'], media_type="application/json", headers=headers)
+
+
+def item_response(request: Request, db: Session, account_id: Optional[str], load: Callable[[], object],
+                  response_model: type):
+    # Serve a single link or tag. For account scope, a client that already has the account's current version gets a
+    # 304 without the row being read. Returns None if load() finds nothing.
+    etag = None
+    if account_id is not None:
+        version = manager.get_account_version(db, account_id)
+        if version is not None:
+            etag = version_etag(request, account_id, version)
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+    item = load()
+    if item is None:
+        return None
+    headers = {'ETag': etag} if etag is not None else {}
+    return Response(content=serialize(response_model.from_orm(item)), media_type="application/json", headers=headers)
+
 
 # Get link by link_id
-@app.get("/link/{link_id}")
-async def get_link(link_id: str, db: Session = Depends(get_db),
-                   current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                      scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+@app.get("/link/{link_id}", response_model=schemas.Link)
+def get_link(link_id: str, request: Request, db: Session = Depends(get_read_db),
+             current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                scopes=["admin", "account"])):
     # If account scope, additionally filter by account_id
-    db_link = manager.get_link(db, link_id, account_id=current_auth_entity.get_account_id())
-    if db_link is None:
+    account_id = current_auth_entity.get_account_id()
+    response = item_response(request, db, account_id, lambda: manager.get_link(db, link_id, account_id=account_id),
+                             schemas.Link)
+    if response is None:
         raise HTTPException(status_code=404, detail=f"Link with link_id {link_id} not found")
-    return db_link
+    return response
 
 
 # Get links by query params
-@app.get("/link/")
-async def get_links(tag_id: Optional[str] = None, tag: Optional[str] = None, account_id: Optional[str] = None,
-                    db: Session = Depends(get_db),
-                    current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                       scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+@app.get("/link/", response_model=List[schemas.Link])
+def get_links(request: Request, tag_id: Optional[str] = None, tag: Optional[str] = None,
+              account_id: Optional[str] = None, limit: int = PageLimit, cursor: Optional[str] = PageCursor,
+              all_tags: Optional[List[str]] = Query(None, description="Only links with all of these tag names"),
+              any_tags: Optional[List[str]] = Query(None, description="Only links with any of these tag names"),
+              not_tags: Optional[List[str]] = Query(None, description="Exclude links with any of these tag names"),
+              db: Session = Depends(get_read_db),
+              current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                 scopes=["admin", "account"])):
     filter_account_id = current_auth_entity.assert_account_id(required=False, account_id=account_id)
-    return manager.get_links(db, tag_id, tag, account_id=filter_account_id)
+    return list_response(request, db, filter_account_id, manager.LINK_KEY, limit, lambda: manager.get_links(
+        db, tag_id, tag, account_id=filter_account_id, limit=limit, cursor=cursor, all_tags=all_tags,
+        any_tags=any_tags, not_tags=not_tags))
 
 
 # Get tag by tag_id
-@app.get("/tag/{tag_id}")
-async def get_tag(tag_id: str, db: Session = Depends(get_db),
-                  current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                     scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
-    db_tag = manager.get_tag(db, tag_id, account_id=current_auth_entity.get_account_id())
-    if db_tag is None:
+@app.get("/tag/{tag_id}", response_model=schemas.Tag)
+def get_tag(tag_id: str, request: Request, db: Session = Depends(get_read_db),
+            current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                               scopes=["admin", "account"])):
+    account_id = current_auth_entity.get_account_id()
+    response = item_response(request, db, account_id, lambda: manager.get_tag(db, tag_id, account_id=account_id),
+                             schemas.Tag)
+    if response is None:
         raise HTTPException(status_code=404, detail=f"Tag with tag_id {tag_id} not found")
-    return db_tag
+    return response
 
 
 # Get tags by query params
-@app.get("/tag/")
-async def get_tags(tag: Optional[str] = None, account_id: Optional[str] = None, db: Session = Depends(get_db),
-                   current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                      scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+@app.get("/tag/", response_model=Union[List[schemas.Tag], List[schemas.TagWithCount]])
+def get_tags(request: Request, tag: Optional[str] = None, account_id: Optional[str] = None,
+             limit: int = PageLimit, cursor: Optional[str] = PageCursor,
+             with_counts: bool = Query(False, description="Include the number of links for each tag"),
+             db: Session = Depends(get_read_db),
+             current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                scopes=["admin", "account"])):
     filter_account_id = current_auth_entity.assert_account_id(required=False, account_id=account_id)
-    return manager.get_tags(db, tag, account_id=filter_account_id)
+    return list_response(request, db, filter_account_id, manager.TAG_KEY, limit, lambda: manager.get_tags(
+        db, tag, account_id=filter_account_id, limit=limit, cursor=cursor, with_counts=with_counts))
 
 
 # Get taglinks by query params
-@app.get("/taglink/")
-async def get_taglinks(link_id: Optional[str] = None, tag_id: Optional[str] = None, account_id: Optional[str] = None,
-                       db: Session = Depends(get_db),
-                       current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                          scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+@app.get("/taglink/", response_model=List[schemas.TagLink])
+def get_taglinks(request: Request, link_id: Optional[str] = None, tag_id: Optional[str] = None,
+                 account_id: Optional[str] = None, limit: int = PageLimit, cursor: Optional[str] = PageCursor,
+                 db: Session = Depends(get_read_db),
+                 current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                    scopes=["admin", "account"])):
     filter_account_id = current_auth_entity.assert_account_id(required=False, account_id=account_id)
-    return manager.get_taglinks(db, tag_id, link_id, account_id=filter_account_id)
-
-
-# Post a link
-@app.post("/link/")
-async def post_link(link: schemas.PostLink, db: Session = Depends(get_db),
-                    current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                       scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+    return list_response(request, db, filter_account_id, manager.TAGLINK_KEY, limit, lambda: manager.get_taglinks(
+        db, tag_id, link_id, account_id=filter_account_id, limit=limit, cursor=cursor))
+
+
+# Get the changes to an account's links, tags and taglinks since a version. Page through with X-Next-Cursor, then
+# pass the X-Sync-Version of the last page as since in the next sync.
+@app.get("/sync/")
+def get_sync(response: Response, since: int = Query(0, ge=0, description="Return changes after this version"),
+             account_id: Optional[str] = None, limit: int = PageLimit, cursor: Optional[str] = PageCursor,
+             db: Session = Depends(get_read_db),
+             current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                scopes=["admin", "account"])):
+    sync_account_id = current_auth_entity.assert_account_id(required=True, account_id=account_id)
+    # Read in the same transaction as the changes, so the version matches them
+    version = manager.get_account_version(db, sync_account_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail=f"Account with account_id '{sync_account_id}' not found")
+    changes, next_cursor = manager.get_changes(db, sync_account_id, since, limit, cursor)
+    response.headers['X-Sync-Version'] = str(version)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return changes
+
+
+def validate_post_link(link: schemas.PostLink, current_auth_entity: schemas.AuthEntity):
     current_auth_entity.assert_account_id(required=True, account_id=link.account_id)
     if current_auth_entity.entity_type == EntityType.ACCOUNT:
         link.account_id = current_auth_entity.get_account_id()
@@ -104,17 +291,50 @@ async def post_link(link: schemas.PostLink, db: Session = Depends(get_db),
     if link.tag is not None and link.tag_id is not None:
         raise HTTPException(status_code=422, detail="Only one of tag_id or tag must be specified")
 
+
+# Post a link
+@app.post("/link/", response_model=schemas.Link)
+def post_link(link: schemas.PostLink, db: Session = Depends(get_db),
+              current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                 scopes=["admin", "account"])):
+    validate_post_link(link, current_auth_entity)
     db_link = manager.create_link(db, link)
 
     return db_link
 
 
+# Post many links in a single transaction
+@app.post("/link/bulk", response_model=List[schemas.BulkLinkResult])
+def post_links(links: List[schemas.PostLink], db: Session = Depends(get_db),
+               current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                  scopes=["admin", "account"])):
+    if len(links) > MAX_BULK_LINKS:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BULK_LINKS} links can be created per request")
+
+    # Invalid items are reported individually and do not prevent the others from being created
+    results = [None] * len(links)
+    valid = []
+    for index, link in enumerate(links):
+        try:
+            validate_post_link(link, current_auth_entity)
+        except HTTPException as ex:
+            results[index] = schemas.BulkLinkResult(index=index, status_code=ex.status_code, detail=ex.detail)
+            continue
+        valid.append((index, link))
+
+    if len(valid) > 0:
+        created = manager.create_links(db, [link for _, link in valid])
+        for (index, _), result in zip(valid, created):
+            results[index] = schemas.BulkLinkResult(index=index, **result)
+
+    return results
+
+
 # Post a tag
-@app.post("/tag/")
-async def post_tag(tag: schemas.PostTag, db: Session = Depends(get_db),
-                   current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                      scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+@app.post("/tag/", response_model=schemas.Tag)
+def post_tag(tag: schemas.PostTag, db: Session = Depends(get_db),
+             current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                scopes=["admin", "account"])):
     current_auth_entity.assert_account_id(required=True, account_id=tag.account_id)
     if current_auth_entity.entity_type == EntityType.ACCOUNT:
         tag.account_id = current_auth_entity.get_account_id()
@@ -124,11 +344,10 @@ async def post_tag(tag: schemas.PostTag, db: Session = Depends(get_db),
 
 
 # Post a taglink
-@app.post("/taglink/")
-async def post_taglink(taglink: schemas.PostTagLink, db: Session = Depends(get_db),
-                       current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                          scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+@app.post("/taglink/", response_model=schemas.TagLink)
+def post_taglink(taglink: schemas.PostTagLink, db: Session = Depends(get_db),
+                 current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                    scopes=["admin", "account"])):
     current_auth_entity.assert_account_id(required=True, account_id=taglink.account_id)
     if current_auth_entity.entity_type == EntityType.ACCOUNT:
         taglink.account_id = current_auth_entity.get_account_id()
@@ -139,36 +358,35 @@ async def post_taglink(taglink: schemas.PostTagLink, db: Session = Depends(get_d
 
 # Delete link by link_id
 @app.delete("/link/{link_id}")
-async def delete_link(link_id: str, db: Session = Depends(get_db),
-                      current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                         scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+def delete_link(link_id: str, db: Session = Depends(get_db),
+                current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                   scopes=["admin", "account"])):
     return manager.delete_link(db, link_id, account_id=current_auth_entity.get_account_id())
 
 
 # Delete tag by tag_id
 @app.delete("/tag/{tag_id}")
-async def delete_tag(tag_id: str, db: Session = Depends(get_db),
-                     current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                        scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+def delete_tag(tag_id: str, db: Session = Depends(get_db),
+               current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                  scopes=["admin", "account"])):
     return manager.delete_tag(db, tag_id, account_id=current_auth_entity.get_account_id())
 
 
 # Delete taglinks by query params
 @app.delete("/taglink/")
-async def delete_taglinks(link_id: Optional[str] = None, tag_id: Optional[str] = None,  db: Session = Depends(get_db),
-                          current_auth_entity: schemas.AuthEntity = Security(
-                              authentication.get_current_active_auth_entity, scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+def delete_taglinks(link_id: Optional[str] = None, tag_id: Optional[str] = None,  db: Session = Depends(get_db),
+                    current_auth_entity: schemas.AuthEntity = Security(
+                        authentication.get_current_active_auth_entity, scopes=["admin", "account"])):
     if link_id is None and tag_id is None:
         raise HTTPException(status_code=422, detail="One or both of tag_id and link_id must be specified")
     return manager.delete_taglinks(db, tag_id, link_id, account_id=current_auth_entity.get_account_id())
 
 
+# Async, so that while the password is verified in the password hashing pool, the request holds no worker thread:
+# a burst of logins queues there (or is rejected with a 503) without starving the other routes of threads
 @app.post("/token/", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    auth_entity = authentication.authenticate(db, form_data.username, form_data.password, form_data.scopes)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+    auth_entity = await authentication.authenticate(form_data.username, form_data.password, form_data.scopes)
     if not auth_entity:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -188,47 +406,124 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 
 # Create a new account
-@app.post("/account/")
-async def post_account(account: schemas.PostAccount, db: Session = Depends(get_db),
-                       current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                          scopes=["admin"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+@app.post("/account/", response_model=schemas.Account)
+def post_account(account: schemas.PostAccount, db: Session = Depends(get_db),
+                 current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                    scopes=["admin"])):
     db_account = manager.create_account(db, account)
 
     return db_account
 
 
 # Get accounts by query params
-@app.get("/account/")
-async def get_accounts(email: Optional[str] = None, db: Session = Depends(get_db),
-                       current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                          scopes=["admin", "account"])):
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
+@app.get("/account/", response_model=List[schemas.Account])
+def get_accounts(response: Response, email: Optional[str] = None, limit: int = PageLimit,
+                 cursor: Optional[str] = PageCursor, db: Session = Depends(get_read_db),
+                 current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                    scopes=["admin", "account"])):
     # Allow account scope to retrieve own account only. Return empty list if email and account_id do not match.
-    return manager.get_accounts(db, email, account_id=current_auth_entity.get_account_id())
+    accounts = manager.get_accounts(db, email, account_id=current_auth_entity.get_account_id(), limit=limit,
+                                    cursor=cursor)
+    set_next_cursor(response, accounts, manager.ACCOUNT_KEY, limit)
+    return accounts
 
 
 # Get account by account_id
-@app.get("/account/{account_id}")
-async def get_account(account_id: str, db: Session = Depends(get_db),
-                      current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
-                                                                         scopes=["admin", "account"])):
+@app.get("/account/{account_id}", response_model=schemas.Account)
+def get_account(account_id: str, request: Request, db: Session = Depends(get_read_db),
+                current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                   scopes=["admin", "account"])):
     # Allow account scope to get own account only
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
     current_auth_entity.assert_account_id(required=True, account_id=account_id, code=404)
     db_account = manager.get_account(db, account_id)
     if db_account is None:
         raise HTTPException(status_code=404, detail=f"Account with account_id '{account_id}' not found")
-    return db_account
+    etag = version_etag(request, account_id, db_account.version)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    return Response(content=serialize(schemas.Account.from_orm(db_account)), media_type="application/json",
+                    headers={'ETag': etag})
 
 
 # Delete account by account_id
 @app.delete("/account/{account_id}")
-async def delete_account(account_id: str, db: Session = Depends(get_db),
-                         current_auth_entity: schemas.AuthEntity = Security(
-                             authentication.get_current_active_auth_entity, scopes=["admin", "account"])):
-    # Allow account scope to delete own account only. Return 404 for other accounts.
-    print(f"authenticated as {current_auth_entity.entity_identifier}")
-    current_auth_entity.assert_account_id(required=True, account_id=account_id, code=404)
+def delete_account(account_id: str, response: Response, background_tasks: BackgroundTasks,
+                   background: bool = Query(False, description="Delete in the background and return a job to poll"),
+                   db: Session = Depends(get_db),
+                   current_auth_entity: schemas.AuthEntity = Security(
+                       authentication.get_current_active_auth_entity, scopes=["admin", "account"])):
+    # Allow account scope to delete own account only. Return 404 for other accounts. The canonical id is used from
+    # here on, so that cached auth entities for the account are found and evicted.
+    account_id = current_auth_entity.assert_account_id(required=True, account_id=account_id, code=404)
+    if background:
+        job = manager.create_account_deletion_job(db, account_id)
+        background_tasks.add_task(run_account_deletion_job, job)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return job
     return manager.delete_account(db, account_id)
 
+
+def run_account_deletion_job(job: schemas.AccountDeletionJob):
+    # Runs after the response is sent, so it needs a session of its own
+    db = SessionLocal()
+    try:
+        manager.run_account_deletion_job(db, job)
+    finally:
+        db.close()
+
+
+# Get the progress of a background account deletion
+@app.get("/account/{account_id}/deletion/{job_id}", response_model=schemas.AccountDeletionJob)
+def get_account_deletion_job(account_id: str, job_id: str,
+                             current_auth_entity: schemas.AuthEntity = Security(
+                                 authentication.get_current_active_auth_entity, scopes=["admin", "account"])):
+    # Jobs record the canonical account id
+    account_id = current_auth_entity.assert_account_id(required=True, account_id=account_id, code=404)
+    job = manager.get_account_deletion_job(job_id)
+    if job is None or job.account_id != account_id:
+        raise HTTPException(status_code=404, detail=f"Deletion job {job_id} not found for account_id {account_id}")
+    return job
+
+
+def stream_account_export(account_id: str):
+    # The stream outlives the request's session, so it reads through a session of its own
+    db = ReadSessionLocal()
+    try:
+        yield from manager.export_account(db, account_id)
+    finally:
+        db.close()
+
+
+# Export all links, tags and taglinks for an account as NDJSON
+@app.get("/account/{account_id}/export")
+def export_account(account_id: str, db: Session = Depends(get_read_db),
+                   current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                      scopes=["admin", "account"])):
+    # Allow account scope to export own account only
+    current_auth_entity.assert_account_id(required=True, account_id=account_id, code=404)
+    if manager.get_account(db, account_id) is None:
+        raise HTTPException(status_code=404, detail=f"Account with account_id '{account_id}' not found")
+    return StreamingResponse(stream_account_export(account_id), media_type="application/x-ndjson")
+
+
+# Prometheus metrics
+@app.get("/metrics", include_in_schema=False)
+def get_metrics(_: Optional[schemas.AuthEntity] = Security(authentication.authorize_metrics_scrape, scopes=["admin"])):
+    return PlainTextResponse(metrics.render(get_pool_stats()), media_type="text/plain; version=0.0.4")
+
+
+# Get service statistics
+@app.get("/stats/")
+def get_stats(current_auth_entity: schemas.AuthEntity = Security(authentication.get_current_active_auth_entity,
+                                                                  scopes=["admin"])):
+    return {
+        "password_hashing": authentication.get_password_hashing_stats(),
+        "auth_cache": authentication.get_auth_cache_stats(),
+        "database_pool": get_pool_stats(),
+        "database_replicas": get_replica_stats(),
+        "response_cache": manager.response_cache.stats(),
+    }
+
+
+route_paths = {route.endpoint: route.path for route in app.routes if hasattr(route, 'endpoint')}
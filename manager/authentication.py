@@ -1,19 +1,32 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Union, Optional, List
+from threading import Lock
+from typing import Union, Optional, List, Callable
+
+import asyncio
+import logging
+import secrets
+import time
 
 from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, SecurityScopes
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 from sqlalchemy.orm import Session
 
-from manager import CONFIG, schemas, models
-from manager.database import get_db
+from manager import CONFIG, schemas, models, metrics, log
+from manager.cache import TTLCache
+from manager.database import SessionLocal, read_your_writes_key
 from manager.schemas import EntityType, AuthEntity
 
 
+LOG = logging.getLogger(__name__)
+
 AUTH_CONFIG = CONFIG['authentication']
+PASSWORD_HASHING_CONFIG = CONFIG.get('password_hashing', {})
+AUTH_CACHE_CONFIG = CONFIG.get('auth_cache', {})
 
 SECRET_KEY = AUTH_CONFIG['secret_key']
 ALGORITHM = "HS256"
@@ -21,10 +34,28 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 SCOPE_ACCOUNT = 'account'
 SCOPE_ADMIN = 'admin'
 SCOPES = {SCOPE_ACCOUNT: 'API actions for a specific account', SCOPE_ADMIN: 'All API actions'}
+PASSWORD_HASHING_WORKERS = PASSWORD_HASHING_CONFIG.get('workers', 4)
+PASSWORD_HASHING_MAX_PENDING = PASSWORD_HASHING_CONFIG.get('max_pending', 32)
+# Cached identities never outlive the token they were looked up for
+AUTH_CACHE_TTL_SECONDS = min(AUTH_CACHE_CONFIG.get('ttl_seconds', ACCESS_TOKEN_EXPIRE_MINUTES * 60),
+                             ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+AUTH_CACHE_MAX_ENTRIES = AUTH_CACHE_CONFIG.get('max_entries', 10000)
+METRICS_SCRAPE_TOKEN = CONFIG.get('metrics', {}).get('scrape_token')
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is deliberately slow, so hashing and verification run in their own bounded pool. Requests beyond
+# PASSWORD_HASHING_MAX_PENDING (running + queued) are rejected with a 503 rather than piling up.
+password_hashing_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASHING_WORKERS,
+                                               thread_name_prefix='password-hashing')
+password_hashing_lock = Lock()
+password_hashing_stats = {'pending': 0, 'completed': 0, 'rejected': 0}
+
+# Verified token identities, keyed by (subject, scope, account_id), so authenticated requests skip the user/account
+# lookup
+auth_entity_cache = TTLCache(max_entries=AUTH_CACHE_MAX_ENTRIES, ttl=AUTH_CACHE_TTL_SECONDS)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", scopes=SCOPES)
 
 app = FastAPI()
@@ -35,12 +66,48 @@ class AuthenticationException(Exception):
         super().__init__(self, msg, *args)
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def submit_password_hashing(func: Callable, *args) -> Future:
+    with password_hashing_lock:
+        if password_hashing_stats['pending'] >= PASSWORD_HASHING_MAX_PENDING:
+            password_hashing_stats['rejected'] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password operations, please retry",
+                headers={"Retry-After": "1"},
+            )
+        password_hashing_stats['pending'] += 1
+    future = password_hashing_executor.submit(func, *args)
+    future.add_done_callback(finish_password_hashing)
+    return future
+
+
+def finish_password_hashing(future: Future):
+    with password_hashing_lock:
+        password_hashing_stats['pending'] -= 1
+        password_hashing_stats['completed'] += 1
+
+
+def get_password_hashing_stats():
+    with password_hashing_lock:
+        pending = password_hashing_stats['pending']
+        return {
+            'workers': PASSWORD_HASHING_WORKERS,
+            'max_pending': PASSWORD_HASHING_MAX_PENDING,
+            'in_progress': min(pending, PASSWORD_HASHING_WORKERS),
+            'queue_depth': max(0, pending - PASSWORD_HASHING_WORKERS),
+            'completed': password_hashing_stats['completed'],
+            'rejected': password_hashing_stats['rejected'],
+        }
+
+
+async def verify_password(plain_password, hashed_password):
+    # Awaited on the event loop, so logins queued for bcrypt hold no request worker threads while they wait
+    return await asyncio.wrap_future(submit_password_hashing(pwd_context.verify, plain_password, hashed_password))
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    # Only used to create accounts, which is admin only, so waiting on the request thread is acceptable
+    return submit_password_hashing(pwd_context.hash, password).result()
 
 
 def get_user(db: Session, username: str):
@@ -75,21 +142,41 @@ def get_auth_entity(db: Session, identifier: str, security_scopes: List[str], en
     return auth_entity
 
 
-def authenticate(db: Session, identifier: str, password: str, security_scopes: List[str]):
+def lookup_auth_entity(identifier: str, security_scopes: List[str], entity_id: Optional[str] = None):
+    # In a session of its own, closed as soon as the lookup is done. Sharing the request's session would hold a
+    # primary connection for the whole request (a second one for reads from ReadSession), and would fix the
+    # transaction's snapshot before write paths take their account lock.
+    db = SessionLocal()
+    try:
+        return get_auth_entity(db, identifier=identifier, security_scopes=security_scopes, entity_id=entity_id)
+    finally:
+        db.close()
+
+
+def evict_auth_entities(account_id: str):
+    # Drop cached identities for an account, e.g. when the account is deleted
+    return auth_entity_cache.evict(lambda key: key[2] == account_id)
+
+
+def get_auth_cache_stats():
+    return auth_entity_cache.stats()
+
+
+async def authenticate(identifier: str, password: str, security_scopes: List[str]):
     # Only one scope should be set
     if len(security_scopes) != 1:
-        print("Too many security scopes set")
+        LOG.info("Login rejected: exactly one scope must be requested", extra={'scopes': security_scopes})
         return False
     try:
-        auth_entity = get_auth_entity(db, identifier=identifier, security_scopes=security_scopes)
+        auth_entity = await run_in_threadpool(lookup_auth_entity, identifier, security_scopes)
     except AuthenticationException as ex:
-        print('Caught AuthenticationException' + str(ex))
+        LOG.info("Login rejected: unknown identifier", extra={'identifier': identifier, 'error': str(ex)})
         return False
     if not auth_entity:
-        print("No auth_entity found")
+        LOG.info("Login rejected: no auth entity found", extra={'identifier': identifier})
         return False
-    if not verify_password(password, auth_entity.hashed_password):
-        print("Password not verified")
+    if not await verify_password(password, auth_entity.hashed_password):
+        LOG.info("Login rejected: password not verified", extra={'identifier': identifier})
         return False
     return auth_entity
 
@@ -105,8 +192,8 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     return encoded_jwt
 
 
-async def get_current_auth_entity(security_scopes: SecurityScopes, db: Session = Depends(get_db),
-                                  token: str = Depends(oauth2_scheme)):
+@metrics.timed('auth')
+def get_current_auth_entity(security_scopes: SecurityScopes, token: str = Depends(oauth2_scheme)):
     if security_scopes.scopes:
         authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
     else:
@@ -123,6 +210,7 @@ async def get_current_auth_entity(security_scopes: SecurityScopes, db: Session =
             raise credentials_exception
         token_scopes = payload.get("scopes", [])
         account_id = payload.get("account_id", None)
+        expires = payload.get("exp", 0)
         token_data = schemas.TokenData(username=username, scopes=token_scopes, account_id=account_id)
     except JWTError:
         raise credentials_exception
@@ -130,16 +218,17 @@ async def get_current_auth_entity(security_scopes: SecurityScopes, db: Session =
     if len(token_scopes) != 1:
         raise credentials_exception
 
-    try:
-        auth_entity = get_auth_entity(db, identifier=token_data.username, security_scopes=token_data.scopes,
-                                      entity_id=token_data.account_id)
-    except RuntimeError:
-        raise credentials_exception
+    cache_key = (token_data.username, token_scopes[0], token_data.account_id)
+    auth_entity = auth_entity_cache.get(cache_key)
+    if auth_entity is None:
+        try:
+            auth_entity = lookup_auth_entity(token_data.username, token_data.scopes, entity_id=token_data.account_id)
+        except AuthenticationException:
+            raise credentials_exception
+        auth_entity_cache.set(cache_key, auth_entity, ttl=min(AUTH_CACHE_TTL_SECONDS, expires - time.time()))
 
     if auth_entity is None:
         raise credentials_exception
-    print(security_scopes.scopes)
-    print(token_data.scopes)
     token_scope = token_scopes[0]
     if token_scope not in security_scopes.scopes:
         raise HTTPException(
@@ -150,5 +239,18 @@ async def get_current_auth_entity(security_scopes: SecurityScopes, db: Session =
     return auth_entity
 
 
+def authorize_metrics_scrape(security_scopes: SecurityScopes, token: str = Depends(oauth2_scheme)):
+    # A scraper can't log in for short-lived access tokens, so /metrics also accepts the static metrics.scrape_token
+    # as its bearer token. Any other token must be an access token with the route's scopes.
+    if METRICS_SCRAPE_TOKEN and secrets.compare_digest(token.encode(), METRICS_SCRAPE_TOKEN.encode()):
+        return None
+    return get_current_auth_entity(security_scopes, token)
+
+
 async def get_current_active_auth_entity(current_auth_entity: schemas.AuthEntity = Depends(get_current_auth_entity)):
+    # Set here, on the event loop, rather than in the sync dependency above: the route handler's worker thread runs
+    # in a copy of this context, so database sessions in the handler can see who the request is from
+    read_your_writes_key.set((current_auth_entity.entity_type, current_auth_entity.entity_id))
+    log.debug_sampled(LOG, "authenticated", entity=current_auth_entity.entity_identifier,
+                      entity_type=current_auth_entity.entity_type.value)
     return current_auth_entity
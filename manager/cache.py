@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+
+    def __init__(self, max_entries: int, ttl: float, max_bytes: Optional[int] = None):
+        """
+        Thread-safe in-process LRU cache whose entries also expire after a time to live
+        :param max_entries: The maximum number of entries kept before the least recently used are evicted
+        :param ttl: The default time to live of an entry, in seconds
+        :param max_bytes: Optionally, the maximum total size of the entries, as given to set(), before the least
+        recently used are evicted
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, value, size = entry
+                if expires > monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, size: int = 0) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (monotonic() + ttl, value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key: Hashable) -> None:
+        # Callers hold the lock
+        self.bytes -= self.entries.pop(key)[2]
+
+    def evict(self, predicate: Callable[[Hashable], bool]) -> int:
+        with self.lock:
+            keys = [key for key in self.entries if predicate(key)]
+            for key in keys:
+                self.remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -1,8 +1,18 @@
-from sqlalchemy import create_engine
+from contextvars import ContextVar
+from itertools import count
+from threading import Lock
+from time import perf_counter, monotonic
+from typing import Hashable, Optional
+
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool
 
 from manager import CONFIG
+from manager.cache import TTLCache
+from manager.metrics import record_sql_statement
 
 database_config = CONFIG['database']
 username = database_config['username']
@@ -10,21 +20,253 @@ password = database_config['password']
 host = database_config['host']
 name = database_config['name']
 port = database_config['port']
+pool_size = database_config.get('pool_size', 5)
+max_overflow = database_config.get('max_overflow', 10)
+pool_timeout = database_config.get('pool_timeout', 30)
+pool_recycle = database_config.get('pool_recycle', 3600)
+pool_pre_ping = database_config.get('pool_pre_ping', False)
+pool_ping_idle_seconds = database_config.get('pool_ping_idle_seconds', 30)
+replica_config = database_config.get('replicas') or []
+REPLICA_CHECK_SECONDS = database_config.get('replica_check_seconds', 10)
+READ_YOUR_WRITES_SECONDS = database_config.get('read_your_writes_seconds', 5)
+REPLICA_CONNECT_TIMEOUT_SECONDS = database_config.get('replica_connect_timeout_seconds', 2)
 
 SQLALCHEMY_DATABASE_URL = f"mariadb+mariadbconnector://{username}:{password}@{host}:{port}/{name}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True, pool_recyle=3600)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Counters cover the primary and any read replicas
+pool_stats_lock = Lock()
+pool_stats = {'checkouts': 0, 'checkout_timeouts': 0, 'checkout_wait_seconds_total': 0.0,
+              'checkout_wait_seconds_max': 0.0, 'idle_pings': 0, 'idle_ping_failures': 0}
+
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool that records how long callers wait to check out a connection, and how often they time out
+
+    def _do_get(self):
+        start = perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            wait = perf_counter() - start
+            with pool_stats_lock:
+                pool_stats['checkouts'] += 1
+                pool_stats['checkout_timeouts'] += int(timed_out)
+                pool_stats['checkout_wait_seconds_total'] += wait
+                pool_stats['checkout_wait_seconds_max'] = max(pool_stats['checkout_wait_seconds_max'], wait)
+
+
+def get_pool_stats():
+    pool = engine.pool
+    with pool_stats_lock:
+        stats = dict(pool_stats)
+    stats.update({
+        'pool_size': pool.size(),
+        'max_overflow': max_overflow,
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(0, pool.overflow()),
+    })
+    return stats
+
+
+def ping_idle_connections(db_engine, idle_seconds: float):
+    # A cheaper alternative to pool_pre_ping, which costs a round trip on every checkout: only connections that have
+    # been idle in the pool for idle_seconds or more are pinged. A failed ping raises DisconnectionError, which makes
+    # the pool discard the connection and transparently retry the checkout with a new one.
+
+    @event.listens_for(db_engine, "checkin")
+    def record_checkin(dbapi_connection, connection_record):
+        connection_record.info['checked_in'] = monotonic()
+
+    @event.listens_for(db_engine, "checkout")
+    def ping_if_idle(dbapi_connection, connection_record, connection_proxy):
+        checked_in = connection_record.info.get('checked_in')
+        if checked_in is None or monotonic() - checked_in < idle_seconds:
+            return
+        with pool_stats_lock:
+            pool_stats['idle_pings'] += 1
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+        except Exception:
+            with pool_stats_lock:
+                pool_stats['idle_ping_failures'] += 1
+            raise exc.DisconnectionError()
+
+
+# Time and count every statement, on every engine, for the per-request SQL metrics and N+1 query detection
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    record_sql_statement(perf_counter() - conn.info['statement_start'].pop(), statement)
+
+
+# A statement that fails, e.g. an insert of a duplicate key, gets no after_cursor_execute: count it here
+@event.listens_for(Engine, "handle_error")
+def stop_failed_statement_timer(context):
+    if context.connection is None or context.statement is None:
+        return
+    starts = context.connection.info.get('statement_start')
+    if starts:
+        record_sql_statement(perf_counter() - starts.pop(), context.statement)
+
+
+def create_database_engine(url: str, pre_ping: bool = pool_pre_ping, connect_args: Optional[dict] = None):
+    db_engine = create_engine(url, poolclass=InstrumentedQueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                              pool_timeout=pool_timeout, pool_recycle=pool_recycle, pool_pre_ping=pre_ping,
+                              connect_args=connect_args or {})
+    if not pre_ping:
+        ping_idle_connections(db_engine, pool_ping_idle_seconds)
+    return db_engine
+
+
+def get_replica_url(replica: dict) -> str:
+    # Replicas use the primary's credentials and database name unless they are given
+    return (f"mariadb+mariadbconnector://{replica.get('username', username)}:{replica.get('password', password)}"
+            f"@{replica['host']}:{replica.get('port', port)}/{replica.get('name', name)}")
+
+
+engine = create_database_engine(SQLALCHEMY_DATABASE_URL)
+# Objects are not expired on commit. The write functions return the rows they have just written, and re-reading
+# them after commit would only fetch back the values the session already holds.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+replica_lock = Lock()
+replica_counter = count()
+replicas = [{'host': replica['host'], 'port': replica.get('port', port),
+             # Health checks run on request threads: bound how long one can wait on an unreachable replica
+             'engine': create_database_engine(get_replica_url(replica),
+                                              connect_args={'connect_timeout': REPLICA_CONNECT_TIMEOUT_SECONDS}),
+             'healthy': False, 'next_check': 0.0, 'checks': 0, 'failures': 0, 'reads': 0}
+            for replica in replica_config]
+
+# Who the current request is authenticated as, set by the authentication dependency. Writes are recorded against it
+# in recent_writes, and for READ_YOUR_WRITES_SECONDS afterwards its reads stay on the primary, so a client never
+# reads data older than its own writes because of replication lag.
+read_your_writes_key: ContextVar[Optional[Hashable]] = ContextVar('read_your_writes_key', default=None)
+recent_writes = TTLCache(max_entries=100000, ttl=READ_YOUR_WRITES_SECONDS)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def record_write(session):
+    key = read_your_writes_key.get()
+    if key is not None:
+        recent_writes.set(key, True)
+
+
+def mark_replica_down(replica: dict):
+    # Skip the replica until its next health check
+    with replica_lock:
+        replica['healthy'] = False
+        replica['failures'] += 1
+        replica['next_check'] = monotonic() + REPLICA_CHECK_SECONDS
+
+
+def watch_replica(replica: dict):
+    @event.listens_for(replica['engine'], "handle_error")
+    def replica_error(context):
+        if context.is_disconnect:
+            mark_replica_down(replica)
+
+
+for replica in replicas:
+    watch_replica(replica)
+
+
+def check_replica(replica: dict):
+    with replica_lock:
+        replica['checks'] += 1
+    try:
+        with replica['engine'].connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except exc.DBAPIError:
+        mark_replica_down(replica)
+        return
+    with replica_lock:
+        replica['healthy'] = True
+
+
+def choose_replica():
+    # Round-robin over the healthy replicas. Each replica is health checked at most every REPLICA_CHECK_SECONDS, and
+    # one that fails its check or drops a connection is skipped until its next check. Returns None, so the read goes
+    # to the primary, when there is no healthy replica or the current client wrote recently.
+    if len(replicas) == 0:
+        return None
+    key = read_your_writes_key.get()
+    if key is not None and recent_writes.get(key) is not None:
+        return None
+    start = next(replica_counter)
+    for offset in range(len(replicas)):
+        replica = replicas[(start + offset) % len(replicas)]
+        with replica_lock:
+            check_due = monotonic() >= replica['next_check']
+            if check_due:
+                replica['next_check'] = monotonic() + REPLICA_CHECK_SECONDS
+        if check_due:
+            check_replica(replica)
+        if replica['healthy']:
+            with replica_lock:
+                replica['reads'] += 1
+            return replica['engine']
+    return None
+
+
+def get_replica_stats():
+    with replica_lock:
+        return [{
+            'host': replica['host'],
+            'port': replica['port'],
+            'healthy': replica['healthy'],
+            'checks': replica['checks'],
+            'failures': replica['failures'],
+            'reads': replica['reads'],
+            'checked_out': replica['engine'].pool.checkedout(),
+        } for replica in replicas]
+
+
+class ReadSession(Session):
+    # Session for read-only requests. The first query picks a replica (or the primary, see choose_replica) and the
+    # rest of the session sticks to it. Anything flushed still goes to the primary.
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not self._flushing:
+            if 'replica' not in self.info:
+                self.info['replica'] = choose_replica()
+            if self.info['replica'] is not None:
+                return self.info['replica']
+        return super().get_bind(mapper, clause, **kw)
+
+
+ReadSessionLocal = sessionmaker(class_=ReadSession, autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
-# Dependency
-def get_db():
-    db = SessionLocal()
+def use_session(session_factory: sessionmaker):
+    db = session_factory()
     try:
         yield db
     except Exception:
         db.rollback()
+        raise
     finally:
         db.close()
+
+
+# Dependency
+def get_db():
+    yield from use_session(SessionLocal)
+
+
+# Dependency for read-only routes, which may be served by a read replica
+def get_read_db():
+    yield from use_session(ReadSessionLocal)
@@ -0,0 +1,43 @@
+from typing import Callable, Optional
+from uuid import UUID, uuid4
+
+import os
+import time
+
+from manager import CONFIG
+
+ID_GENERATOR = CONFIG.get('ids', {}).get('generator', 'uuid7')
+
+
+def uuid7() -> UUID:
+    # RFC 9562 UUIDv7: a 48 bit Unix timestamp in milliseconds followed by random bits. Later ids sort after earlier
+    # ones, so inserts append to the end of the clustered primary key index instead of splitting random pages.
+    timestamp_ms = time.time_ns() // 1000000
+    value = (timestamp_ms & 0xFFFFFFFFFFFF) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | 0x7 << 76
+    value = value & ~(0x3 << 62) | 0x2 << 62
+    return UUID(int=value)
+
+
+GENERATORS = {'uuid4': uuid4, 'uuid7': uuid7}
+
+if ID_GENERATOR not in GENERATORS:
+    raise ValueError(f"Unknown ids.generator '{ID_GENERATOR}', expected one of {', '.join(GENERATORS)}")
+
+generate: Callable[[], UUID] = GENERATORS[ID_GENERATOR]
+
+
+def new_id() -> str:
+    # A new primary key value, from the configured generator
+    return str(generate())
+
+
+def normalize_id(value: Optional[str]) -> Optional[str]:
+    # The canonical (lowercase, hyphenated) form of an id given by a client, as ids are stored and returned. Values
+    # that are not UUIDs are returned unchanged: they match no row and are reported as not found.
+    if value is None:
+        return None
+    try:
+        return str(UUID(value))
+    except ValueError:
+        return value
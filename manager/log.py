@@ -0,0 +1,87 @@
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Optional, TextIO
+
+import atexit
+import logging
+import random
+import sys
+
+import orjson
+
+from manager import CONFIG
+
+LOGGING_CONFIG = CONFIG.get('logging', {})
+LEVEL = LOGGING_CONFIG.get('level', 'INFO')
+DEBUG_SAMPLE_RATE = LOGGING_CONFIG.get('debug_sample_rate', 0.01)
+
+# Attributes every LogRecord has. Anything else on a record was passed with extra= and is logged as a field.
+RECORD_ATTRIBUTES = set(logging.LogRecord('', logging.INFO, '', 0, '', (), None).__dict__) | {'message', 'request_id'}
+
+# Id of the request being handled, set by the request id middleware and attached to every line logged for it
+request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+listener: Optional[QueueListener] = None
+
+
+class RequestIdFilter(logging.Filter):
+    # Runs in the logging thread, before the record is queued, so it sees that thread's request id
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    # One JSON object per line, for journald and log shippers
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None) is not None:
+            entry['request_id'] = record.request_id
+        # Tracebacks are already part of the message: QueueHandler formats them in before queuing the record
+        entry.update({key: value for key, value in record.__dict__.items() if key not in RECORD_ATTRIBUTES})
+        return orjson.dumps(entry, default=str).decode()
+
+
+def configure_logging(level: str = LEVEL, stream: TextIO = sys.stdout):
+    # Route all logging through a queue: logging calls in request handlers only merge the message arguments and
+    # enqueue the record, and a background thread formats it as JSON and does the (blocking) write to the stream
+    global listener
+    stop_logging()
+    queue = SimpleQueue()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JSONFormatter())
+    listener = QueueListener(queue, handler, respect_handler_level=True)
+
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener.start()
+
+
+@atexit.register
+def stop_logging():
+    # Flush queued records on shutdown
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def debug_sampled(logger: logging.Logger, msg: str, **fields):
+    # For debug lines on hot paths (every request): only DEBUG_SAMPLE_RATE of them are logged, and nothing at all is
+    # done unless debug logging is enabled
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < DEBUG_SAMPLE_RATE:
+        logger.debug(msg, extra=fields)
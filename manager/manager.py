@@ -1,13 +1,150 @@
-from typing import Optional
+from typing import Optional, List, Sequence, Dict, Tuple
 from datetime import datetime
 
 from uuid import uuid4
 
-from sqlalchemy.orm import Session
+import base64
+import json
+
+from sqlalchemy import and_, or_, insert, select, update, func, literal, exists, exc, union_all
+from sqlalchemy.dialects.mysql import insert as upsert
+from sqlalchemy.orm import Session, Query
 
 from fastapi import HTTPException
 
-from manager import models, schemas, authentication
+from manager import models, schemas, authentication, ids, CONFIG
+from manager.cache import TTLCache
+
+PAGINATION_CONFIG = CONFIG.get('pagination', {})
+DEFAULT_PAGE_SIZE = PAGINATION_CONFIG.get('default_limit', 100)
+MAX_PAGE_SIZE = PAGINATION_CONFIG.get('max_limit', 1000)
+EXPORT_BATCH_SIZE = CONFIG.get('export', {}).get('batch_size', 1000)
+ACCOUNT_DELETION_CONFIG = CONFIG.get('account_deletion', {})
+ACCOUNT_DELETION_BATCH_SIZE = ACCOUNT_DELETION_CONFIG.get('batch_size', 10000)
+RESPONSE_CACHE_CONFIG = CONFIG.get('response_cache', {})
+
+# Keyset pagination keys: list results are ordered by, and resume after, these (unique) columns
+LINK_KEY = (models.Link.link_id,)
+TAG_KEY = (models.Tag.tag_id,)
+TAGLINK_KEY = (models.TagLink.tag_id, models.TagLink.link_id)
+ACCOUNT_KEY = (models.Account.account_id,)
+
+# Columns returned by the list queries. Rows of plain columns are much cheaper to load and serialize than ORM
+# instances, and hashed_password is never read.
+LINK_COLUMNS = (models.Link.link_id, models.Link.account_id, models.Link.link, models.Link.seq)
+TAG_COLUMNS = (models.Tag.tag_id, models.Tag.account_id, models.Tag.tag, models.Tag.seq)
+TAGLINK_COLUMNS = (models.TagLink.tag_id, models.TagLink.link_id, models.TagLink.account_id, models.TagLink.seq)
+ACCOUNT_COLUMNS = (models.Account.account_id, models.Account.email, models.Account.created, models.Account.version)
+
+# MariaDB error number for a duplicate key
+ER_DUP_ENTRY = 1062
+
+# Per-account tables, in the order their rows must be deleted
+ACCOUNT_DATA_MODELS = (models.Tombstone, models.TagLink, models.TagCount, models.Tag, models.Link)
+
+# Incremental sync sources, in the order changes with the same seq are returned, and their keyset keys
+SYNC_KEYS = {
+    'link': (models.Link.seq, models.Link.link_id),
+    'tag': (models.Tag.seq, models.Tag.tag_id),
+    'taglink': (models.TagLink.seq, models.TagLink.tag_id, models.TagLink.link_id),
+    'tombstone': (models.Tombstone.seq, models.Tombstone.tombstone_id),
+}
+SYNC_SOURCES = list(SYNC_KEYS)
+
+# Background account deletion jobs, kept for a day after they are started
+account_deletion_jobs = TTLCache(max_entries=ACCOUNT_DELETION_CONFIG.get('max_jobs', 1000), ttl=24 * 60 * 60)
+
+# Serialized list responses, keyed by (account_id, account version, endpoint, query params). Every write below bumps
+# the version of the accounts it touches, so their cached responses are never served again and age out. Any object
+# with the same get/set/evict/stats methods as TTLCache, e.g. a client for a shared cache, can be assigned here
+# instead. Besides the entry count, the cache is bounded by the total size of the cached bodies, and bodies larger
+# than RESPONSE_CACHE_MAX_ENTRY_BYTES (large pages) are not cached at all.
+response_cache = TTLCache(max_entries=RESPONSE_CACHE_CONFIG.get('max_entries', 10000),
+                          ttl=RESPONSE_CACHE_CONFIG.get('ttl_seconds', 60),
+                          max_bytes=RESPONSE_CACHE_CONFIG.get('max_bytes', 64 * 1024 * 1024))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = RESPONSE_CACHE_CONFIG.get('max_entry_bytes', 256 * 1024)
+
+
+def bump_account_version(db: Session, *account_ids: str, missing_ok: bool = False) -> Dict[str, int]:
+    # Every change to an account's links, tags or taglinks increments its version in the same transaction. The
+    # version identifies a state of the account's data, for ETags and cached responses. Call this before writing
+    # any of the account's rows: taking the account row's exclusive lock first, rather than after foreign key checks
+    # have share locked it, avoids deadlocks between concurrent writes to the same account. Returns the new version
+    # of each account, which is the seq of the rows the write creates or deletes. Unless missing_ok, any account that
+    # does not exist is a 404; with it, missing accounts are left out of the result.
+    # Compared below with ids as the database returns them, so in their canonical form
+    account_ids = {ids.normalize_id(account_id) for account_id in account_ids}
+    if len(account_ids) == 0:
+        return {}
+    db.execute(update(models.Account).where(models.Account.account_id.in_(account_ids)).values(
+        version=models.Account.version + 1))
+    versions = dict(db.query(models.Account.account_id, models.Account.version).filter(
+        models.Account.account_id.in_(account_ids)).all())
+    missing = account_ids - versions.keys()
+    if len(missing) > 0 and not missing_ok:
+        raise HTTPException(status_code=404, detail=f"Account id {missing.pop()} not found")
+    return versions
+
+
+def get_account_version(db: Session, account_id: str) -> Optional[int]:
+    return db.query(models.Account.version).filter(models.Account.account_id == account_id).scalar()
+
+
+def encode_cursor(values: Sequence[str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str, length: Optional[int] = None) -> List[str]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values) or (
+            length is not None and len(values) != length):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    return values
+
+
+def after_key(key: Sequence, values: Sequence):
+    # (k1, k2) > (v1, v2), expanded so MariaDB can use the key index as a range
+    return or_(*[and_(*[column == value for column, value in zip(key[:i], values[:i])], key[i] > values[i])
+                 for i in range(len(key))])
+
+
+def paginate(query: Query, key: Sequence, limit: Optional[int] = None, cursor: Optional[str] = None):
+    # Without a limit or cursor (internal callers), return every matching row
+    if limit is None and cursor is None:
+        return query.all()
+    if cursor is not None:
+        query = query.filter(after_key(key, decode_cursor(cursor, len(key))))
+    query = query.order_by(*key)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def get_next_cursor(rows: list, key: Sequence, limit: Optional[int]) -> Optional[str]:
+    # A full page means there may be more rows after the last one returned
+    if limit is None or len(rows) < limit:
+        return None
+    last = rows[-1]
+    if isinstance(last, dict):
+        return encode_cursor([last[column.key] for column in key])
+    return encode_cursor([getattr(last, column.key) for column in key])
+
+
+def update_tag_counts(db: Session, changes: Dict[Tuple[str, str], int]):
+    # Apply link count changes, keyed by (tag_id, account_id), to the tag_count table with one upsert. Pending rows
+    # are flushed first so that new tags exist for the foreign key.
+    rows = [{'tag_id': tag_id, 'account_id': account_id, 'link_count': change}
+            for (tag_id, account_id), change in changes.items() if change != 0]
+    if len(rows) == 0:
+        return
+    db.flush()
+    statement = upsert(models.TagCount)
+    statement = statement.on_duplicate_key_update(
+        link_count=models.TagCount.link_count + statement.inserted.link_count)
+    db.execute(statement, rows)
 
 
 def get_link(db: Session, link_id: str, account_id: Optional[str] = None):
@@ -31,68 +168,102 @@ def get_tag_by_tag_name(db: Session, tag: str, account_id: Optional[str]):
     return db.query(models.Tag).filter(*filters).first()
 
 
-def get_links(db: Session, tag_id: Optional[str] = None, tag: Optional[str] = None, account_id: Optional[str] = None):
-    filters = []
-    filter_tags = []
-    if tag is None and tag_id is None and account_id is None:
-        # TODO: Implement offset and limit
-        return db.query(models.Link).all()
-    if tag is not None:
-        # tag_record = get_tag_by_tag_name(db, tag, account_id)
-        tag_records = get_tags(db, tag, account_id)
-        if len(tag_records) == 0:
-            return []
-        for tag_record in tag_records:
-            filter_tags.append(tag_record.tag_id)
+def select_tagged_link_ids(tags: List[str], account_id: Optional[str] = None):
+    # link_ids of the taglinks for any of the named tags. Filtering taglink on account_id lets MariaDB use the
+    # taglink (account_id, tag_id) index.
+    query = select(models.TagLink.link_id).join(models.Tag, models.Tag.tag_id == models.TagLink.tag_id).where(
+        models.Tag.tag.in_(tags))
     if account_id is not None:
-        filters.append(models.Link.account_id == account_id)
-    if tag_id is not None:
-        filter_tags.append(tag_id)
-    if len(filter_tags) > 0:
-        filters.append(models.TagLink.tag_id.in_(filter_tags))
-        return db.query(models.Link).join(models.TagLink).filter(*filters).all()
+        query = query.where(models.TagLink.account_id == account_id)
+    return query
 
-    return db.query(models.Link).filter(*filters).all()
 
+def get_links(db: Session, tag_id: Optional[str] = None, tag: Optional[str] = None, account_id: Optional[str] = None,
+              limit: Optional[int] = None, cursor: Optional[str] = None, all_tags: Optional[List[str]] = None,
+              any_tags: Optional[List[str]] = None, not_tags: Optional[List[str]] = None):
+    query = db.query(*LINK_COLUMNS)
+    filters = []
+    if account_id is not None:
+        filters.append(models.Link.account_id == account_id)
 
-def get_tags(db: Session, tag: Optional[str] = None, account_id: Optional[str] = None):
+    if tag is not None or tag_id is not None:
+        # A single query joining link, taglink and tag. DISTINCT, as a link can match more than one tag.
+        query = query.join(models.TagLink, models.TagLink.link_id == models.Link.link_id).join(
+            models.Tag, models.Tag.tag_id == models.TagLink.tag_id).distinct()
+        if account_id is not None:
+            filters.append(models.TagLink.account_id == account_id)
+        tag_filters = []
+        if tag is not None:
+            tag_filters.append(models.Tag.tag == tag)
+        if tag_id is not None:
+            tag_filters.append(models.TagLink.tag_id == tag_id)
+        filters.append(or_(*tag_filters))
+
+    if all_tags:
+        # AND: links having every one of the tags, one correlated EXISTS per name. Each name is compared with
+        # tag.tag in SQL, so names the column collation treats as equal ('cafe', 'café') match the same tag instead
+        # of being counted as two different tags.
+        for name in dict.fromkeys(all_tags):
+            filters.append(select_tagged_link_ids([name], account_id).where(
+                models.TagLink.link_id == models.Link.link_id).exists())
+
+    if any_tags:
+        # OR: links having at least one of the tags
+        filters.append(models.Link.link_id.in_(select_tagged_link_ids(any_tags, account_id)))
+
+    if not_tags:
+        # NOT: anti-join against links having any of the tags
+        excluded = select_tagged_link_ids(not_tags, account_id).distinct().subquery()
+        query = query.outerjoin(excluded, excluded.c.link_id == models.Link.link_id)
+        filters.append(excluded.c.link_id.is_(None))
+
+    return paginate(query.filter(*filters), LINK_KEY, limit, cursor)
+
+
+def get_tags(db: Session, tag: Optional[str] = None, account_id: Optional[str] = None, limit: Optional[int] = None,
+             cursor: Optional[str] = None, with_counts: bool = False):
     filters = []
-    if tag is None and account_id is None:
-        # TODO: Implement offset and limit
-        return db.query(models.Tag).all()
     if tag is not None:
         filters.append(models.Tag.tag == tag)
     if account_id is not None:
         filters.append(models.Tag.account_id == account_id)
-    return db.query(models.Tag).filter(*filters).all()
+    if not with_counts:
+        return paginate(db.query(*TAG_COLUMNS).filter(*filters), TAG_KEY, limit, cursor)
+
+    # Link counts come from the maintained tag_count table, so this costs one row per tag whatever the number of
+    # taglinks. Tags without a tag_count row have no links.
+    query = db.query(models.Tag.tag_id, models.Tag.account_id, models.Tag.tag,
+                     func.coalesce(models.TagCount.link_count, 0).label('link_count')).outerjoin(
+        models.TagCount, models.TagCount.tag_id == models.Tag.tag_id)
+    return [row._asdict() for row in paginate(query.filter(*filters), TAG_KEY, limit, cursor)]
 
 
 def get_taglinks(db: Session, tag_id: Optional[str] = None, link_id: Optional[str] = None,
-                 account_id: Optional[str] = None):
+                 account_id: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None):
+    filters = get_taglink_filters(tag_id, link_id, account_id)
+    return paginate(db.query(*TAGLINK_COLUMNS).filter(*filters), TAGLINK_KEY, limit, cursor)
+
+
+def get_taglink_filters(tag_id: Optional[str] = None, link_id: Optional[str] = None,
+                        account_id: Optional[str] = None):
     filters = []
-    if tag_id is None and link_id is None and account_id is None:
-        # TODO: Implement offset and limit
-        return db.query(models.TagLink).all()
     if tag_id is not None:
         filters.append(models.TagLink.tag_id == tag_id)
     if link_id is not None:
         filters.append(models.TagLink.link_id == link_id)
     if account_id is not None:
         filters.append(models.TagLink.account_id == account_id)
-
-    return db.query(models.TagLink).filter(*filters).all()
+    return filters
 
 
-def get_accounts(db: Session, email: Optional[str] = None, account_id: Optional[str] = None):
+def get_accounts(db: Session, email: Optional[str] = None, account_id: Optional[str] = None,
+                 limit: Optional[int] = None, cursor: Optional[str] = None):
     filters = []
-    if email is None and account_id is None:
-        # TODO: Implement offset and limit
-        return db.query(models.Account).all()
     if email is not None:
         filters.append(models.Account.email == email)
     if account_id is not None:
         filters.append(models.Account.account_id == account_id)
-    return db.query(models.Account).filter(*filters).all()
+    return paginate(db.query(*ACCOUNT_COLUMNS).filter(*filters), ACCOUNT_KEY, limit, cursor)
 
 
 def get_account(db: Session, account_id: str):
@@ -101,7 +272,8 @@ def get_account(db: Session, account_id: str):
 
 
 def create_link(db: Session, link: schemas.PostLink):
-    db_link = models.Link(link_id=str(uuid4()), link=link.link, account_id=link.account_id)
+    seq = bump_account_version(db, link.account_id)[link.account_id]
+    db_link = models.Link(link_id=ids.new_id(), link=link.link, account_id=link.account_id, seq=seq)
     db.add(db_link)
     tag_id = link.tag_id
     link_id = db_link.link_id
@@ -109,7 +281,7 @@ def create_link(db: Session, link: schemas.PostLink):
     if link.tag is not None:
         db_tag = get_tag_by_tag_name(db, link.tag, link.account_id)
         if db_tag is None:
-            db_tag = models.Tag(tag_id=str(uuid4()), tag=link.tag, account_id=link.account_id)
+            db_tag = models.Tag(tag_id=ids.new_id(), tag=link.tag, account_id=link.account_id, seq=seq)
             db.add(db_tag)
             tag_id = db_tag.tag_id
         else:
@@ -120,22 +292,87 @@ def create_link(db: Session, link: schemas.PostLink):
             raise HTTPException(status_code=404,
                                 detail=f"Tag with tag_id {tag_id} not found for account_id {link.account_id}")
 
-    db_taglink = models.TagLink(link_id=link_id, tag_id=tag_id, account_id=link.account_id)
+    db_taglink = models.TagLink(link_id=link_id, tag_id=tag_id, account_id=link.account_id, seq=seq)
     db.add(db_taglink)
+    update_tag_counts(db, {(tag_id, link.account_id): 1})
 
     db.commit()
-    db.refresh(db_link)
     return db_link
 
 
+def create_links(db: Session, links: List[schemas.PostLink]):
+    # Create many links in one transaction. Tag names are resolved with one upsert and one query, tag ids with a single
+    # IN query, and links and taglinks are inserted with executemany. Returns one result per link, in order.
+    # The accounts' versions are bumped first, as in create_link, so their rows are locked before their tags are
+    # read: a tag cannot then be deleted between the lookup and the insert. An account all of whose links fail is
+    # bumped all the same, which only costs its clients a cache miss.
+    versions = bump_account_version(db, *{link.account_id for link in links}, missing_ok=True)
+    account_ids = set(versions)
+    tag_names = list(dict.fromkeys((link.account_id, link.tag) for link in links
+                                   if link.tag is not None and link.account_id in account_ids))
+    tag_ids = {link.tag_id for link in links if link.tag_id is not None and link.account_id in account_ids}
+
+    # Whether two tag names are the same tag is up to the column's collation, which ignores case, accents and
+    # trailing spaces, so it is left to the database. Every name is inserted, doing nothing where the (account_id,
+    # tag) unique key already has the tag (or an equal name earlier in the batch), and each name is then mapped to
+    # its tag by a join under the same collation.
+    tags_by_name = {}
+    if len(tag_names) > 0:
+        statement = upsert(models.Tag)
+        db.execute(statement.on_duplicate_key_update(tag_id=models.Tag.tag_id),
+                   [{'tag_id': ids.new_id(), 'account_id': account_id, 'tag': tag, 'seq': versions[account_id]}
+                    for account_id, tag in tag_names])
+        names = union_all(*[select(literal(account_id, models.Tag.account_id.type).label('account_id'),
+                                   literal(tag).label('tag')) for account_id, tag in tag_names]).subquery()
+        query = db.query(names.c.account_id, names.c.tag, models.Tag.tag_id).join(
+            models.Tag, and_(models.Tag.account_id == names.c.account_id, models.Tag.tag == names.c.tag))
+        tags_by_name = {(account_id, tag): tag_id for account_id, tag, tag_id in query}
+    existing_tag_ids = set()
+    if len(tag_ids) > 0:
+        query = db.query(models.Tag.account_id, models.Tag.tag_id).filter(
+            models.Tag.account_id.in_(account_ids), models.Tag.tag_id.in_(tag_ids))
+        existing_tag_ids = {(account_id, tag_id) for account_id, tag_id in query}
+
+    results = []
+    new_links = []
+    new_taglinks = []
+    tag_count_changes = {}
+    for link in links:
+        if link.account_id not in account_ids:
+            results.append({'status_code': 404, 'detail': f"Account id {link.account_id} not found"})
+            continue
+        if link.tag is not None:
+            tag_id = tags_by_name[(link.account_id, link.tag)]
+        else:
+            tag_id = link.tag_id
+            if (link.account_id, tag_id) not in existing_tag_ids:
+                results.append({'status_code': 404,
+                                'detail': f"Tag with tag_id {tag_id} not found for account_id {link.account_id}"})
+                continue
+        link_id = ids.new_id()
+        new_links.append({'link_id': link_id, 'account_id': link.account_id, 'link': link.link})
+        new_taglinks.append({'tag_id': tag_id, 'link_id': link_id, 'account_id': link.account_id})
+        tag_count_changes[(tag_id, link.account_id)] = tag_count_changes.get((tag_id, link.account_id), 0) + 1
+        results.append({'status_code': 200, 'link_id': link_id, 'tag_id': tag_id})
+
+    for model, rows in ((models.Link, new_links), (models.TagLink, new_taglinks)):
+        if len(rows) > 0:
+            for row in rows:
+                row['seq'] = versions[row['account_id']]
+            db.execute(insert(model), rows)
+    update_tag_counts(db, tag_count_changes)
+    db.commit()
+    return results
+
+
 def create_tag(db: Session, tag: schemas.PostTag):
-    db_tag = models.Tag(tag_id=str(uuid4()), tag=tag.tag, account_id=tag.account_id)
+    db_tag = models.Tag(tag_id=ids.new_id(), tag=tag.tag, account_id=tag.account_id)
     db_tag_existing = get_tags(db, tag=tag.tag, account_id=tag.account_id)
     if len(db_tag_existing) > 0:
         raise HTTPException(status_code=409, detail=f"Tag with name {tag.tag} exists for account {tag.account_id}")
+    db_tag.seq = bump_account_version(db, tag.account_id)[tag.account_id]
     db.add(db_tag)
     db.commit()
-    db.refresh(db_tag)
     return db_tag
 
 
@@ -143,27 +380,38 @@ def create_taglink(db: Session, taglink: schemas.PostTagLink):
     tag_id = taglink.tag_id
     link_id = taglink.link_id
     account_id = taglink.account_id
-    db_taglink = models.TagLink(tag_id=tag_id, link_id=link_id, account_id=account_id)
-    db_tag_id_existing = get_tag(db, tag_id, account_id)
-    if db_tag_id_existing is None:
+    # Bump first, so the account row is locked while the tag and link are checked: neither can then be deleted
+    # before the insert. Any error below rolls the bump back with the rest of the transaction.
+    seq = bump_account_version(db, account_id)[account_id]
+    # Check that the tag and the link belong to the account in one query
+    tag_found, link_found = db.query(
+        exists().where(models.Tag.tag_id == tag_id, models.Tag.account_id == account_id),
+        exists().where(models.Link.link_id == link_id, models.Link.account_id == account_id)).one()
+    if not tag_found:
         raise HTTPException(status_code=422, detail=f"Tag with tag_id {tag_id} not found for account_id {account_id}")
-    db_link_id_existing = get_link(db, link_id, account_id)
-    if db_link_id_existing is None:
+    if not link_found:
         raise HTTPException(status_code=422, detail=f"Link with link_id {link_id} not found for account_id {account_id}")
-    db_taglink_existing = get_taglinks(db, tag_id=tag_id, link_id=link_id, account_id=account_id)
-    if len(db_taglink_existing) > 0:
+    # An existing taglink is found by the insert failing on the (tag_id, link_id) primary key, not looked up first
+    db.add(models.TagLink(tag_id=tag_id, link_id=link_id, account_id=account_id, seq=seq))
+    try:
+        db.flush()
+    except exc.IntegrityError as ex:
+        db.rollback()
+        if getattr(ex.orig, 'errno', None) != ER_DUP_ENTRY:
+            raise
         raise HTTPException(status_code=409, detail=f"TagLink with tag_id {tag_id} and link_id {link_id} exists")
-    db.add(db_taglink)
+    update_tag_counts(db, {(tag_id, account_id): 1})
     db.commit()
-    db.refresh(db_taglink)
-    return db_taglink
+    return schemas.TagLink(tag_id=tag_id, link_id=link_id, account_id=account_id, seq=seq)
 
 
 def delete_link(db: Session, link_id: str, account_id: Optional[str] = None):
     db_link = get_link(db, link_id=link_id, account_id=account_id)
     if not db_link:
         raise HTTPException(status_code=404, detail=f"Link with link_id {link_id} not found")
-    delete_taglinks(db, link_id=link_id)
+    seq = bump_account_version(db, db_link.account_id)[db_link.account_id]
+    delete_taglinks(db, link_id=link_id, account_id=db_link.account_id, version_bumped=True, commit=False)
+    db.add(models.Tombstone(account_id=db_link.account_id, seq=seq, kind='link', link_id=link_id))
     db.delete(db_link)
     db.commit()
     return "OK"
@@ -173,19 +421,43 @@ def delete_tag(db: Session, tag_id: str, account_id: Optional[str] = None):
     db_tag = get_tag(db, tag_id=tag_id, account_id=account_id)
     if not db_tag:
         raise HTTPException(status_code=404, detail=f"Tag with tag_id {tag_id} not found")
-    delete_taglinks(db, tag_id=tag_id)
+    seq = bump_account_version(db, db_tag.account_id)[db_tag.account_id]
+    delete_taglinks(db, tag_id=tag_id, account_id=db_tag.account_id, version_bumped=True, commit=False)
+    db.add(models.Tombstone(account_id=db_tag.account_id, seq=seq, kind='tag', tag_id=tag_id))
+    db.query(models.TagCount).filter(models.TagCount.tag_id == tag_id).delete(synchronize_session=False)
     db.delete(db_tag)
     db.commit()
     return "OK"
 
 
 def delete_taglinks(db: Session, tag_id: Optional[str] = None, link_id: Optional[str] = None,
-                    account_id: Optional[str] = None):
-    db_taglinks = get_taglinks(db, tag_id=tag_id, link_id=link_id, account_id=account_id)
-    for db_taglink in db_taglinks:
-        db.delete(db_taglink)
-    db.commit()
-    return "OK"
+                    account_id: Optional[str] = None, version_bumped: bool = False, commit: bool = True):
+    # A single filtered DELETE, however many taglinks match. Returns the number of taglinks deleted. Callers deleting
+    # the link or tag as well pass commit=False and commit once, so the whole delete is one transaction.
+    # With an account_id, the account is locked by bumping its version before anything is read, unless the caller
+    # has already done so in this transaction (version_bumped). Without one (admin), the accounts are only known
+    # from the taglinks, and are bumped after them.
+    filters = get_taglink_filters(tag_id, link_id, account_id)
+    if account_id is not None and not version_bumped:
+        bump_account_version(db, account_id)
+    # Count what is about to be deleted per tag (one aggregate query) to keep tag_count up to date. A locking read,
+    # like the INSERT ... SELECT and DELETE below, so it counts the latest committed taglinks, exactly the ones
+    # deleted, rather than those in a snapshot taken before the account was locked.
+    removed = db.query(models.TagLink.tag_id, models.TagLink.account_id, func.count()).filter(*filters).group_by(
+        models.TagLink.tag_id, models.TagLink.account_id).with_for_update().all()
+    if account_id is None:
+        bump_account_version(db, *[account_id for _, account_id, _ in removed])
+    # One tombstone per taglink, at its account's new version
+    db.execute(insert(models.Tombstone).from_select(
+        ['account_id', 'seq', 'kind', 'tag_id', 'link_id'],
+        select(models.TagLink.account_id, models.Account.version, literal('taglink'), models.TagLink.tag_id,
+               models.TagLink.link_id).join(models.Account, models.Account.account_id == models.TagLink.account_id
+                                            ).where(*filters)))
+    deleted = db.query(models.TagLink).filter(*filters).delete(synchronize_session=False)
+    update_tag_counts(db, {(tag_id, account_id): -count for tag_id, account_id, count in removed})
+    if commit:
+        db.commit()
+    return deleted
 
 
 def get_account_from_email(db: Session, email: str):
@@ -195,31 +467,149 @@ def get_account_from_email(db: Session, email: str):
 def create_account(db: Session, account: schemas.PostAccount):
     hashed_password = authentication.get_password_hash(account.password)
     now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    db_account = models.Account(account_id=str(uuid4()), email=account.email, hashed_password=hashed_password,
-                                created=now)
+    db_account = models.Account(account_id=ids.new_id(), email=account.email, hashed_password=hashed_password,
+                                created=now, version=0)
     db_account_existing = get_account_from_email(db, email=account.email)
     if db_account_existing is not None:
         raise HTTPException(status_code=409, detail=f"Account with email {account.email} exists")
     db.add(db_account)
     db.commit()
-    db.refresh(db_account)
     return db_account
 
 
+def export_account(db: Session, account_id: str):
+    # Yield an account's links, tags and taglinks as chunks of NDJSON lines. Rows are streamed from a server-side
+    # cursor in batches of EXPORT_BATCH_SIZE, so memory use does not depend on the size of the account.
+    exports = [
+        ('link', db.query(models.Link.link_id, models.Link.account_id, models.Link.link).filter(
+            models.Link.account_id == account_id)),
+        ('tag', db.query(models.Tag.tag_id, models.Tag.account_id, models.Tag.tag).filter(
+            models.Tag.account_id == account_id)),
+        ('taglink', db.query(models.TagLink.tag_id, models.TagLink.link_id, models.TagLink.account_id).filter(
+            models.TagLink.account_id == account_id)),
+    ]
+    for record_type, query in exports:
+        lines = []
+        for row in query.yield_per(EXPORT_BATCH_SIZE):
+            lines.append(json.dumps({'type': record_type, **row._asdict()}) + '\n')
+            if len(lines) >= EXPORT_BATCH_SIZE:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
+
+
+def get_changes(db: Session, account_id: str, since: int, limit: int, cursor: Optional[str] = None):
+    # Links, tags and taglinks created, and tombstones of those deleted, by account versions after since, ordered by
+    # (seq, source, key). Each source is read with its own keyset query on its (account_id, seq) index and the
+    # results merged, so a page costs four short range scans however large the account is. Returns the page and the
+    # cursor of the next page, if there is one.
+    after = None
+    if cursor is not None:
+        values = decode_cursor(cursor)
+        source = values[1] if len(values) > 1 else None
+        if source not in SYNC_KEYS or len(values) != len(SYNC_KEYS[source]) + 1 or not values[0].isdigit():
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+        after = (int(values[0]), SYNC_SOURCES.index(source), values[2:])
+
+    changes = []
+    for rank, (source, key) in enumerate(SYNC_KEYS.items()):
+        model = key[0].class_
+        seq = key[0]
+        query = db.query(model).filter(model.account_id == account_id, seq > since)
+        if after is not None:
+            after_seq, after_rank, after_values = after
+            if rank < after_rank:
+                query = query.filter(seq > after_seq)
+            elif rank == after_rank:
+                if source == 'tombstone':
+                    after_values = [int(value) for value in after_values if value.isdigit()]
+                if len(after_values) != len(key) - 1:
+                    raise HTTPException(status_code=422, detail="Invalid cursor")
+                query = query.filter(after_key(key, [after_seq, *after_values]))
+            else:
+                query = query.filter(seq >= after_seq)
+        # One row more than a page shows whether there is a next page
+        changes.extend((row.seq, rank, row) for row in query.order_by(*key).limit(limit + 1))
+
+    # A stable sort keeps each source's key order within a seq
+    changes.sort(key=lambda change: change[:2])
+    next_cursor = None
+    if len(changes) > limit:
+        changes = changes[:limit]
+        seq, rank, row = changes[-1]
+        next_cursor = encode_cursor([str(seq), SYNC_SOURCES[rank]] + [
+            str(getattr(row, column.key)) for column in SYNC_KEYS[SYNC_SOURCES[rank]][1:]])
+    return [get_change(row) for _, _, row in changes], next_cursor
+
+
+def get_change(row) -> dict:
+    if isinstance(row, models.Tombstone):
+        change = {'kind': row.kind, 'seq': row.seq, 'deleted': True}
+        if row.tag_id is not None:
+            change['tag_id'] = row.tag_id
+        if row.link_id is not None:
+            change['link_id'] = row.link_id
+        return change
+    change = {'kind': row.__tablename__, 'seq': row.seq, 'deleted': False}
+    change.update({column.key: getattr(row, column.key) for column in row.__table__.columns
+                   if column.key not in ('seq', 'account_id')})
+    return change
+
+
 def delete_account(db: Session, account_id: str):
     db_account = get_account(db, account_id=account_id)
     if db_account is None:
         raise HTTPException(status_code=404, detail=f"Account id {account_id} not found")
-    delete_taglinks(db, account_id=account_id)
-    tags = get_tags(db, account_id=account_id)
-    for db_tag in tags:
-        db.delete(db_tag)
-        db.commit()
-    links = get_links(db, account_id=account_id)
-    for db_link in links:
-        print(db_link)
-        db.delete(db_link)
-        db.commit()
-    db.delete(db_account)
+    # One set-based DELETE per table, in dependency order, in a single transaction
+    for model in ACCOUNT_DATA_MODELS:
+        db.query(model).filter(model.account_id == account_id).delete(synchronize_session=False)
+    db.query(models.Account).filter(models.Account.account_id == account_id).delete(synchronize_session=False)
     db.commit()
+    authentication.evict_auth_entities(account_id)
     return "OK"
+
+
+def create_account_deletion_job(db: Session, account_id: str):
+    db_account = get_account(db, account_id=account_id)
+    if db_account is None:
+        raise HTTPException(status_code=404, detail=f"Account id {account_id} not found")
+    # The total counts the account row itself as well as its data
+    total = 1 + sum(db.query(model).filter(model.account_id == account_id).count() for model in ACCOUNT_DATA_MODELS)
+    job = schemas.AccountDeletionJob(job_id=str(uuid4()), account_id=account_id, status=schemas.JobStatus.PENDING,
+                                     total=total, deleted=0)
+    account_deletion_jobs.set(job.job_id, job)
+    return job
+
+
+def get_account_deletion_job(job_id: str):
+    return account_deletion_jobs.get(job_id)
+
+
+def run_account_deletion_job(db: Session, job: schemas.AccountDeletionJob):
+    # Delete a large account in batches of ACCOUNT_DELETION_BATCH_SIZE rows, committing after each batch so no single
+    # transaction holds locks for long, and record progress on the job as it goes
+    job.status = schemas.JobStatus.RUNNING
+    try:
+        for model in ACCOUNT_DATA_MODELS:
+            # Taglinks are deleted by link, so a batch may be slightly larger than the batch size
+            batch_column = models.TagLink.link_id if model is models.TagLink else model.__mapper__.primary_key[0]
+            while True:
+                batch = db.query(batch_column).filter(model.account_id == job.account_id).distinct().limit(
+                    ACCOUNT_DELETION_BATCH_SIZE).all()
+                if len(batch) == 0:
+                    break
+                bump_account_version(db, job.account_id)
+                job.deleted += db.query(model).filter(
+                    model.account_id == job.account_id, batch_column.in_([row[0] for row in batch])
+                ).delete(synchronize_session=False)
+                db.commit()
+        db.query(models.Account).filter(models.Account.account_id == job.account_id).delete(synchronize_session=False)
+        db.commit()
+        job.deleted += 1
+        job.status = schemas.JobStatus.COMPLETE
+    except Exception as ex:
+        db.rollback()
+        job.status = schemas.JobStatus.FAILED
+        job.detail = str(ex)
+    authentication.evict_auth_entities(job.account_id)
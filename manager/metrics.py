@@ -0,0 +1,175 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import logging
+
+from manager import CONFIG
+
+LOG = logging.getLogger(__name__)
+
+METRICS_CONFIG = CONFIG.get('metrics', {})
+SLOW_REQUEST_SECONDS = METRICS_CONFIG.get('slow_request_seconds', 1.0)
+LATENCY_BUCKETS = METRICS_CONFIG.get('latency_buckets',
+                                     [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0])
+# A request running the same SQL statement (with different parameters) more than this many times is logged as a
+# likely N+1 query: a query per row of an earlier result, where one set-based query would do
+REPEATED_STATEMENT_THRESHOLD = METRICS_CONFIG.get('repeated_statement_threshold', 10)
+STATEMENT_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100]
+# Time within a request is broken down into these phases (which may overlap, e.g. SQL run while authenticating)
+PHASES = ('auth', 'sql', 'serialize')
+# Database pool statistics that only ever increase; the others are current values
+POOL_COUNTERS = {'checkouts', 'checkout_timeouts', 'checkout_wait_seconds_total', 'idle_pings', 'idle_ping_failures'}
+
+
+class RequestStats:
+
+    def __init__(self):
+        """
+        Where the time of one request went, filled in as it is handled
+        """
+        self.sql_statements = 0
+        # Executions of each distinct SQL statement text
+        self.statement_counts: Dict[str, int] = {}
+        self.phase_seconds = {phase: 0.0 for phase in PHASES}
+
+    def max_repeats(self) -> int:
+        # Most executions of any one statement: 1 if none was repeated, 0 if none ran
+        return max(self.statement_counts.values(), default=0)
+
+    def most_repeated_statement(self) -> Optional[str]:
+        if len(self.statement_counts) == 0:
+            return None
+        return max(self.statement_counts, key=self.statement_counts.get)
+
+
+class Histogram:
+
+    def __init__(self, buckets: Sequence[float]):
+        """
+        A Prometheus style histogram
+        :param buckets: Upper bounds of the buckets, in increasing order. A +Inf bucket is added.
+        """
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# Stats of the request being handled. The middleware sets a new RequestStats per request; the route handler's worker
+# thread runs in a copy of the middleware's context, so it records into the same object.
+current_request_stats: ContextVar[Optional[RequestStats]] = ContextVar('current_request_stats', default=None)
+
+metrics_lock = Lock()
+request_counts: Dict[Tuple[str, str, int], int] = {}
+request_durations: Dict[Tuple[str, str], Histogram] = {}
+request_sql_statements: Dict[Tuple[str, str], Histogram] = {}
+request_phase_durations: Dict[Tuple[str, str, str], Histogram] = {}
+
+
+def record_phase(phase: str, seconds: float):
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.phase_seconds[phase] += seconds
+
+
+def record_sql_statement(seconds: float, statement: str):
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.statement_counts[statement] = stats.statement_counts.get(statement, 0) + 1
+        stats.phase_seconds['sql'] += seconds
+
+
+def timed(phase: str):
+    # Decorator adding the time spent in a function to the current request's phase
+    def decorator(func: Callable):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_phase(phase, perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def observe_request(method: str, route: str, status_code: int, seconds: float, stats: RequestStats):
+    with metrics_lock:
+        request_counts[(method, route, status_code)] = request_counts.get((method, route, status_code), 0) + 1
+        request_durations.setdefault((method, route), Histogram(LATENCY_BUCKETS)).observe(seconds)
+        request_sql_statements.setdefault((method, route), Histogram(STATEMENT_BUCKETS)).observe(
+            stats.sql_statements)
+        for phase, phase_seconds in stats.phase_seconds.items():
+            request_phase_durations.setdefault((method, route, phase), Histogram(LATENCY_BUCKETS)).observe(
+                phase_seconds)
+
+    if seconds > SLOW_REQUEST_SECONDS:
+        LOG.warning(f"Slow request: {method} {route} returned {status_code} in {seconds:.3f}s "
+                    f"(budget {SLOW_REQUEST_SECONDS:.3f}s), {stats.sql_statements} SQL statements in "
+                    f"{stats.phase_seconds['sql']:.3f}s, auth {stats.phase_seconds['auth']:.3f}s, "
+                    f"serialize {stats.phase_seconds['serialize']:.3f}s")
+
+    if stats.max_repeats() > REPEATED_STATEMENT_THRESHOLD:
+        LOG.warning(f"Possible N+1 query: {method} {route} ran the same SQL statement {stats.max_repeats()} times",
+                    extra={'statement': stats.most_repeated_statement()})
+
+
+def format_labels(labels: Dict[str, object]) -> str:
+    escaped = {name: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for name, value in labels.items()}
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped.items()) + '}'
+
+
+def format_histogram(name: str, labels: Dict[str, object], histogram: Histogram) -> list:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{format_labels({**labels, "le": bound})} {cumulative}')
+    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+    return lines
+
+
+def render(pool_stats: Dict[str, float]) -> str:
+    # All metrics in the Prometheus text exposition format
+    lines = ['# HELP taglink_http_requests_total Requests handled',
+             '# TYPE taglink_http_requests_total counter']
+    with metrics_lock:
+        for (method, route, status_code), count in sorted(request_counts.items()):
+            labels = {'method': method, 'route': route, 'status': status_code}
+            lines.append(f'taglink_http_requests_total{format_labels(labels)} {count}')
+
+        lines += ['# HELP taglink_http_request_duration_seconds Request latency',
+                  '# TYPE taglink_http_request_duration_seconds histogram']
+        for (method, route), histogram in sorted(request_durations.items()):
+            lines += format_histogram('taglink_http_request_duration_seconds', {'method': method, 'route': route},
+                                      histogram)
+
+        lines += ['# HELP taglink_http_request_sql_statements SQL statements executed per request',
+                  '# TYPE taglink_http_request_sql_statements histogram']
+        for (method, route), histogram in sorted(request_sql_statements.items()):
+            lines += format_histogram('taglink_http_request_sql_statements', {'method': method, 'route': route},
+                                      histogram)
+
+        lines += ['# HELP taglink_http_request_phase_seconds Time per request spent authenticating, in SQL and '
+                  'serializing',
+                  '# TYPE taglink_http_request_phase_seconds histogram']
+        for (method, route, phase), histogram in sorted(request_phase_durations.items()):
+            lines += format_histogram('taglink_http_request_phase_seconds',
+                                      {'method': method, 'route': route, 'phase': phase}, histogram)
+
+    for key, value in sorted(pool_stats.items()):
+        name = f'taglink_db_pool_{key}'
+        lines += [f'# TYPE {name} {"counter" if key in POOL_COUNTERS else "gauge"}', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
@@ -1,36 +1,85 @@
-from sqlalchemy import Column, ForeignKey, String, UniqueConstraint
+from uuid import UUID
+
+from sqlalchemy import BINARY, BigInteger, Column, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy.types import TypeDecorator
 
 from manager.database import Base
 
 
+class BinaryUUID(TypeDecorator):
+    # Stores a UUID in 16 bytes (BINARY(16)) rather than as CHAR(36) text, while still exposing it to the
+    # application and the API as the usual 36 character string
+    impl = BINARY(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return UUID(str(value)).bytes
+        except ValueError:
+            # Not a UUID, so it cannot match any stored id: compare against NULL instead
+            return None
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return str(UUID(bytes=bytes(value)))
+
+
 class Link(Base):
     __tablename__ = "link"
 
-    link_id = Column(String, primary_key=True, index=True)
-    account_id = Column(String, ForeignKey("account.account_id"), index=True)
+    link_id = Column(BinaryUUID, primary_key=True, index=True)
+    account_id = Column(BinaryUUID, ForeignKey("account.account_id"), index=True)
     link = Column(String)
+    # The account version that created the row, for incremental sync
+    seq = Column(BigInteger, nullable=False, default=0)
 
 
 class Tag(Base):
     __tablename__ = "tag"
 
-    tag_id = Column(String, primary_key=True, index=True)
-    account_id = Column(String, ForeignKey("account.account_id"), index=True)
+    tag_id = Column(BinaryUUID, primary_key=True, index=True)
+    account_id = Column(BinaryUUID, ForeignKey("account.account_id"), index=True)
     tag = Column(String)
+    seq = Column(BigInteger, nullable=False, default=0)
 
 
 class TagLink(Base):
     __tablename__ = "taglink"
 
-    tag_id = Column(String, ForeignKey("tag.tag_id"), primary_key=True, index=True)
-    link_id = Column(String, ForeignKey("link.link_id"), primary_key=True, index=True)
-    account_id = Column(String, ForeignKey("account.account_id"), index=True)
+    tag_id = Column(BinaryUUID, ForeignKey("tag.tag_id"), primary_key=True, index=True)
+    link_id = Column(BinaryUUID, ForeignKey("link.link_id"), primary_key=True, index=True)
+    account_id = Column(BinaryUUID, ForeignKey("account.account_id"), index=True)
+    seq = Column(BigInteger, nullable=False, default=0)
+
+
+class TagCount(Base):
+    __tablename__ = "tag_count"
+
+    tag_id = Column(BinaryUUID, ForeignKey("tag.tag_id"), primary_key=True, index=True)
+    account_id = Column(BinaryUUID, ForeignKey("account.account_id"), index=True)
+    link_count = Column(Integer)
+
+
+class Tombstone(Base):
+    # A deleted link (link_id), tag (tag_id) or taglink (tag_id and link_id), and the account version that deleted
+    # it, for incremental sync
+    __tablename__ = "tombstone"
+
+    tombstone_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    account_id = Column(BinaryUUID, ForeignKey("account.account_id"), index=True)
+    seq = Column(BigInteger, nullable=False)
+    kind = Column(String)
+    tag_id = Column(BinaryUUID)
+    link_id = Column(BinaryUUID)
 
 
 class User(Base):
     __tablename__ = "user"
 
-    user_id = Column(String, primary_key=True, index=True)
+    user_id = Column(BinaryUUID, primary_key=True, index=True)
     username = Column(String)
     hashed_password = Column(String)
 
@@ -38,9 +87,11 @@ class User(Base):
 class Account(Base):
     __tablename__ = "account"
 
-    account_id = Column(String, primary_key=True, index=True)
+    account_id = Column(BinaryUUID, primary_key=True, index=True)
     email = Column(String)
     hashed_password = Column(String)
     created = Column(String)
+    # Incremented by every change to the account's links, tags and taglinks
+    version = Column(BigInteger, nullable=False, default=0)
 
 
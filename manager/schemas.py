@@ -1,10 +1,13 @@
 from typing import Optional, Union, List
+from datetime import datetime
 from enum import Enum
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
 
 from fastapi import HTTPException
 
+from manager import ids
+
 
 class PostLink(BaseModel):
     link: str = Field(..., description="The link URL")
@@ -15,6 +18,18 @@ class PostLink(BaseModel):
         None,
         description="The account ID. Not required for account scope. Required for admin scope.")
 
+    @validator('tag_id', 'account_id')
+    def normalize_id(cls, value):
+        return ids.normalize_id(value)
+
+
+class BulkLinkResult(BaseModel):
+    index: int = Field(..., description="Position of the link in the request")
+    status_code: int = Field(..., description="200 if the link was created, otherwise the error status")
+    link_id: Optional[str] = Field(None, description="The new link ID")
+    tag_id: Optional[str] = Field(None, description="The tag ID the link was associated with")
+    detail: Optional[str] = Field(None, description="Error detail, if the link was not created")
+
 
 class PostTag(BaseModel):
     tag: str = Field(..., description="Tag name")
@@ -22,6 +37,10 @@ class PostTag(BaseModel):
         None,
         description="The account ID. Not required for account scope. Required for admin scope.")
 
+    @validator('account_id')
+    def normalize_id(cls, value):
+        return ids.normalize_id(value)
+
 
 class PostTagLink(BaseModel):
     tag_id: str = Field(..., description="Tag ID (must already exist)")
@@ -30,6 +49,10 @@ class PostTagLink(BaseModel):
         None,
         description="The account ID. Not required for account scope. Required for admin scope.")
 
+    @validator('tag_id', 'link_id', 'account_id')
+    def normalize_id(cls, value):
+        return ids.normalize_id(value)
+
 
 class PostAccount(BaseModel):
     email: str = Field(..., description="Email Address for the new account")
@@ -48,6 +71,53 @@ class TokenData(BaseModel):
     account_id: Union[str, None] = None
 
 
+class Link(BaseModel):
+    link_id: str
+    account_id: str
+    link: str
+    seq: int
+
+    class Config:
+        orm_mode = True
+
+
+class Tag(BaseModel):
+    tag_id: str
+    account_id: str
+    tag: str
+    seq: int
+
+    class Config:
+        orm_mode = True
+
+
+class TagWithCount(BaseModel):
+    tag_id: str
+    account_id: str
+    tag: str
+    link_count: int = Field(..., description="Number of links with the tag")
+
+
+class TagLink(BaseModel):
+    tag_id: str
+    link_id: str
+    account_id: str
+    seq: int
+
+    class Config:
+        orm_mode = True
+
+
+class Account(BaseModel):
+    account_id: str
+    email: str
+    created: datetime
+    version: int
+
+    class Config:
+        orm_mode = True
+
+
 class User(BaseModel):
     user_id: str
     username: str
@@ -61,6 +131,22 @@ class EntityType(str, Enum):
     ACCOUNT = 'account'
 
 
+class JobStatus(str, Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+
+
+class AccountDeletionJob(BaseModel):
+    job_id: str
+    account_id: str
+    status: JobStatus
+    total: int = Field(..., description="Number of rows to delete, including the account itself")
+    deleted: int = Field(..., description="Number of rows deleted so far")
+    detail: Optional[str] = None
+
+
 class AuthEntity(BaseModel):
     entity_type: EntityType
     entity_id: str
@@ -75,6 +161,7 @@ class AuthEntity(BaseModel):
 
     def assert_account_id(self, required: bool = True, account_id: Optional[str] = None, code: Optional[int] = 422):
         # Check if a provided account_id matches the AuthEntity account id, if scope account
+        account_id = ids.normalize_id(account_id)
         valid = True
         msg_422 = "Invalid account_id"
         if account_id is not None and self.entity_type == EntityType.ACCOUNT:
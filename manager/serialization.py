@@ -0,0 +1,29 @@
+from typing import Any, List
+
+import orjson
+
+from pydantic import BaseModel
+from sqlalchemy.engine import Row
+
+from manager.metrics import timed
+
+
+def rows_to_dicts(rows: List[Any]) -> List[Any]:
+    # Rows of columns (from the list queries) become dicts keyed by column name. The keys are looked up once for the
+    # whole list rather than per row.
+    if len(rows) == 0 or not isinstance(rows[0], Row):
+        return rows
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
+
+
+@timed('serialize')
+def serialize(content: Any) -> bytes:
+    # JSON encode a response body with orjson, which handles str, int, dict, list and datetime natively. Unlike
+    # FastAPI's default path, nothing goes through jsonable_encoder, so content must be plain data, rows of columns
+    # or a Pydantic response model.
+    if isinstance(content, BaseModel):
+        content = content.dict()
+    elif isinstance(content, list):
+        content = rows_to_dicts(content)
+    return orjson.dumps(content)
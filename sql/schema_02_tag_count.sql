@@ -0,0 +1,4 @@
+USE apiservice;
+CREATE TABLE IF NOT EXISTS tag_count (tag_id CHAR(36) NOT NULL, account_id CHAR(36) NOT NULL, link_count INT NOT NULL DEFAULT 0, PRIMARY KEY (tag_id), INDEX (account_id), CONSTRAINT FOREIGN KEY (tag_id) REFERENCES tag (tag_id), CONSTRAINT FOREIGN KEY (account_id) REFERENCES account (account_id)) CHARACTER SET utf8 COLLATE utf8_general_ci;
+-- Backfill the counts from existing taglinks
+INSERT INTO tag_count (tag_id, account_id, link_count) SELECT tag_id, account_id, COUNT(*) FROM taglink GROUP BY tag_id, account_id ON DUPLICATE KEY UPDATE link_count = VALUES(link_count);
@@ -0,0 +1,28 @@
+-- Store all ids as BINARY(16) instead of CHAR(36) utf8 (up to 108 bytes per key in InnoDB indexes).
+-- Each table is rebuilt as <table>_new with converted ids, then swapped in. Foreign keys created against the
+-- _new tables follow them through the RENAME.
+USE apiservice;
+SET FOREIGN_KEY_CHECKS = 0;
+
+CREATE TABLE account_new (account_id BINARY(16) NOT NULL, email VARCHAR(255), hashed_password VARCHAR(255), created DATETIME DEFAULT UTC_TIMESTAMP(), PRIMARY KEY (account_id), UNIQUE KEY (email)) CHARACTER SET utf8 COLLATE utf8_general_ci;
+INSERT INTO account_new (account_id, email, hashed_password, created) SELECT UNHEX(REPLACE(account_id, '-', '')), email, hashed_password, created FROM account;
+
+CREATE TABLE user_new (user_id BINARY(16) NOT NULL DEFAULT UNHEX(REPLACE(UUID(), '-', '')), username VARCHAR(255), hashed_password VARCHAR(255), PRIMARY KEY (user_id), INDEX (username)) CHARACTER SET utf8 COLLATE utf8_general_ci;
+INSERT INTO user_new (user_id, username, hashed_password) SELECT UNHEX(REPLACE(user_id, '-', '')), username, hashed_password FROM user;
+
+CREATE TABLE link_new (link_id BINARY(16) NOT NULL, account_id BINARY(16) NOT NULL, link TEXT, PRIMARY KEY (link_id), INDEX (account_id), CONSTRAINT FOREIGN KEY (account_id) REFERENCES account_new (account_id)) CHARACTER SET utf8 COLLATE utf8_general_ci;
+INSERT INTO link_new (link_id, account_id, link) SELECT UNHEX(REPLACE(link_id, '-', '')), UNHEX(REPLACE(account_id, '-', '')), link FROM link;
+
+CREATE TABLE tag_new (tag_id BINARY(16) NOT NULL, account_id BINARY(16) NOT NULL, tag VARCHAR(255), PRIMARY KEY (tag_id), INDEX (tag), UNIQUE KEY (account_id, tag), CONSTRAINT FOREIGN KEY (account_id) REFERENCES account_new (account_id)) CHARACTER SET utf8 COLLATE utf8_general_ci;
+INSERT INTO tag_new (tag_id, account_id, tag) SELECT UNHEX(REPLACE(tag_id, '-', '')), UNHEX(REPLACE(account_id, '-', '')), tag FROM tag;
+
+CREATE TABLE taglink_new (tag_id BINARY(16) NOT NULL, link_id BINARY(16) NOT NULL, account_id BINARY(16) NOT NULL, PRIMARY KEY (tag_id, link_id), INDEX (tag_id), INDEX (link_id), INDEX (account_id, tag_id), INDEX (account_id, link_id), CONSTRAINT FOREIGN KEY (tag_id) REFERENCES tag_new (tag_id), CONSTRAINT FOREIGN KEY (link_id) REFERENCES link_new (link_id), CONSTRAINT FOREIGN KEY (account_id) REFERENCES account_new (account_id)) CHARACTER SET utf8 COLLATE utf8_general_ci;
+INSERT INTO taglink_new (tag_id, link_id, account_id) SELECT UNHEX(REPLACE(tag_id, '-', '')), UNHEX(REPLACE(link_id, '-', '')), UNHEX(REPLACE(account_id, '-', '')) FROM taglink;
+
+CREATE TABLE tag_count_new (tag_id BINARY(16) NOT NULL, account_id BINARY(16) NOT NULL, link_count INT NOT NULL DEFAULT 0, PRIMARY KEY (tag_id), INDEX (account_id), CONSTRAINT FOREIGN KEY (tag_id) REFERENCES tag_new (tag_id), CONSTRAINT FOREIGN KEY (account_id) REFERENCES account_new (account_id)) CHARACTER SET utf8 COLLATE utf8_general_ci;
+INSERT INTO tag_count_new (tag_id, account_id, link_count) SELECT UNHEX(REPLACE(tag_id, '-', '')), UNHEX(REPLACE(account_id, '-', '')), link_count FROM tag_count;
+
+DROP TABLE tag_count, taglink, tag, link, user, account;
+RENAME TABLE account_new TO account, user_new TO user, link_new TO link, tag_new TO tag, taglink_new TO taglink, tag_count_new TO tag_count;
+
+SET FOREIGN_KEY_CHECKS = 1;
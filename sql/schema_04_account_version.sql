@@ -0,0 +1,3 @@
+USE apiservice;
+-- Incremented by every change to an account's links, tags and taglinks, for ETags and cached responses
+ALTER TABLE account ADD COLUMN IF NOT EXISTS version BIGINT UNSIGNED NOT NULL DEFAULT 0;
@@ -0,0 +1,12 @@
+USE apiservice;
+-- The account version that created each link, tag and taglink, for incremental sync (GET /sync/)
+ALTER TABLE link ADD COLUMN IF NOT EXISTS seq BIGINT UNSIGNED NOT NULL DEFAULT 0, ADD INDEX (account_id, seq);
+ALTER TABLE tag ADD COLUMN IF NOT EXISTS seq BIGINT UNSIGNED NOT NULL DEFAULT 0, ADD INDEX (account_id, seq);
+ALTER TABLE taglink ADD COLUMN IF NOT EXISTS seq BIGINT UNSIGNED NOT NULL DEFAULT 0, ADD INDEX (account_id, seq);
+-- Deleted links (link_id), tags (tag_id) and taglinks (tag_id and link_id)
+CREATE TABLE IF NOT EXISTS tombstone (tombstone_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT, account_id BINARY(16) NOT NULL, seq BIGINT UNSIGNED NOT NULL, kind VARCHAR(16) NOT NULL, tag_id BINARY(16), link_id BINARY(16), PRIMARY KEY (tombstone_id), INDEX (account_id, seq), CONSTRAINT FOREIGN KEY (account_id) REFERENCES account (account_id)) CHARACTER SET utf8 COLLATE utf8_general_ci;
+-- Backfill: existing rows count as created by a new version of their account, so a sync since 0 returns them
+UPDATE account SET version = version + 1;
+UPDATE link JOIN account ON account.account_id = link.account_id SET link.seq = account.version;
+UPDATE tag JOIN account ON account.account_id = tag.account_id SET tag.seq = account.version;
+UPDATE taglink JOIN account ON account.account_id = taglink.account_id SET taglink.seq = account.version;